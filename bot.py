@@ -2,13 +2,33 @@
 # Requires: Python 3.10+, pip install discord.py aiosqlite
 # Set environment variables or edit DEFAULT_* values below.
 
+import logging
 import os
+import re
+import signal
+import sys
+import tempfile
+import threading
 import discord
-from discord.ext import commands
+from discord.ext import commands, tasks
 import random
 import aiosqlite
 import asyncio
-from typing import Optional
+import bisect
+import csv
+import gzip
+import itertools
+import json
+import shutil
+import sqlite3
+import time
+import urllib.parse
+import weakref
+from collections import Counter, OrderedDict, defaultdict
+from contextlib import AsyncExitStack, asynccontextmanager
+from functools import lru_cache, wraps
+from datetime import datetime, timedelta, timezone
+from typing import NamedTuple, Optional
 
 # -------------------------
 # ENV / CONFIG
@@ -24,6 +44,41 @@ COINS_PER_SPIN = 10     # 10 coins = 1 spin
 SPIN_COST = COINS_PER_SPIN
 
 DB_FILE = "casino.db"
+DB_POOL_SIZE = int(os.getenv("DB_POOL_SIZE") or 4)                  # long-lived connections shared by all commands
+DB_BUSY_TIMEOUT_MS = int(os.getenv("DB_BUSY_TIMEOUT_MS") or 5000)   # how long a writer waits for the lock
+SPIN_BATCH_SIZE = int(os.getenv("SPIN_BATCH_SIZE") or 256)          # max spins settled per group commit
+SPIN_FLUSH_MS = float(os.getenv("SPIN_FLUSH_MS") or 5)              # max time a spin waits for its group commit
+BALANCE_CACHE_SIZE = int(os.getenv("BALANCE_CACHE_SIZE") or 10000)  # users whose balance is kept in memory
+EXPORT_DIR = os.getenv("EXPORT_DIR") or "exports"                    # where !export keeps files too large to attach
+EXPORT_PAGE_SIZE = 5000                                              # rows fetched per keyset page when exporting
+LEDGER_PAGE_MAX = 100                                                # most rows one !ledger page shows
+RECONCILE_INTERVAL = float(os.getenv("RECONCILE_INTERVAL") or 900)   # seconds between background reconciliations (0 = off)
+ARCHIVE_DIR = os.getenv("ARCHIVE_DIR") or "archive"                  # per-month archive files for old spins / ledger rows
+ARCHIVE_AFTER_DAYS = float(os.getenv("ARCHIVE_AFTER_DAYS") or 90)    # rows older than this move out of casino.db
+ARCHIVE_INTERVAL = float(os.getenv("ARCHIVE_INTERVAL") or 0)         # seconds between background archive runs (0 = off, opt-in)
+ARCHIVE_BATCH = 5000                                                 # ledger rows moved per transaction
+BACKUP_DIR = os.getenv("BACKUP_DIR") or "backups"                    # compressed casino.db snapshots (archive files under archive/)
+BACKUP_INTERVAL = float(os.getenv("BACKUP_INTERVAL") or 21600)       # seconds between background backups (0 = off)
+BACKUP_KEEP = int(os.getenv("BACKUP_KEEP") or 14)                    # newest snapshots kept, older ones are deleted
+BACKUP_STEP_PAGES = int(os.getenv("BACKUP_STEP_PAGES") or 256)       # pages copied per backup step
+BACKUP_STEP_SLEEP_MS = float(os.getenv("BACKUP_STEP_SLEEP_MS") or 2) # pause between steps so other work gets the CPU / disk
+BULK_MAX_ROWS = int(os.getenv("BULK_MAX_ROWS") or 5000)              # most cashouts / credits one bulk command may touch
+LEADERBOARD_SIZE = 10                                                # players shown by !leaderboard
+LEADERBOARD_TTL = float(os.getenv("LEADERBOARD_TTL") or 30)          # seconds a cached leaderboard is reused
+CASHOUT_PAGE_SIZE = 10                                               # requests per !list_requests page
+CASHOUT_QUEUE_TTL = float(os.getenv("CASHOUT_QUEUE_TTL") or 5)       # seconds a shard process trusts its cached queue
+METRICS_HOST = os.getenv("METRICS_HOST") or "127.0.0.1"
+METRICS_PORT = int(os.getenv("METRICS_PORT")) if os.getenv("METRICS_PORT") else None   # serve /metrics here (optional, needs flask)
+PROFILE_SAMPLING = os.getenv("PROFILE_SAMPLING") == "1"                # start the sampling profiler at boot
+PROFILE_INTERVAL_MS = float(os.getenv("PROFILE_INTERVAL_MS") or 5)     # sampling profiler period
+
+# Deployment: "standalone" runs everything in one process. launcher.py runs one "writer" process
+# that owns casino.db plus several "shard" processes that hold gateway shards, read casino.db
+# read-only and send every mutation to the writer over WRITER_SOCKET.
+ROLE = os.getenv("CASINO_ROLE") or "standalone"                     # standalone | writer | shard
+WRITER_SOCKET = os.getenv("WRITER_SOCKET") or "casino-writer.sock"   # Unix socket the writer listens on
+SHARD_COUNT = int(os.getenv("SHARD_COUNT")) if os.getenv("SHARD_COUNT") else None   # total shards across all processes
+SHARD_IDS = [int(s) for s in os.getenv("SHARD_IDS").split(",")] if os.getenv("SHARD_IDS") else None  # shards this process runs
 
 TOKEN = os.getenv("DISCORD_TOKEN") or DEFAULT_TOKEN
 ANNOUNCE_CHANNEL_ID = int(os.getenv("ANNOUNCE_CHANNEL_ID")) if os.getenv("ANNOUNCE_CHANNEL_ID") else DEFAULT_ANNOUNCE_CHANNEL
@@ -34,11 +89,14 @@ if admins_env:
         a = a.strip()
         if a.isdigit():
             ADMIN_IDS.add(int(a))
+ANNOUNCE_QUEUE_SIZE = int(os.getenv("ANNOUNCE_QUEUE_SIZE") or 500)          # pending wins before overflow is merged
+ANNOUNCE_INTERVAL = float(os.getenv("ANNOUNCE_INTERVAL") or 1.5)            # min seconds between announce messages
 
 # -------------------------
 # Slot / Prize configuration
 # -------------------------
 SYMBOLS = ["7", "BAR", "🍒", "🍋"]  # adjust or weight if desired
+SYMBOL_WEIGHTS = [1, 1, 1, 1]       # relative chance of each symbol per reel (same order as SYMBOLS)
 
 # Prize table (coins)
 # Note: coins -> pence = coins / PENCE_TO_COINS
@@ -49,99 +107,2574 @@ PRIZES = {
     ("🍋", "🍋", "🍋"): 50
 }
 
+MULTISPIN_MAX = int(os.getenv("MULTISPIN_MAX") or 1000)   # most spins one !multispin may draw
+
+# -------------------------
+# Reel engine
+# -------------------------
+# Symbols are drawn as integer codes (index into SYMBOLS) and a whole spin is one packed
+# outcome = c1*N*N + c2*N + c3. PAYOUTS and OUTCOME_SYMBOLS are flat lookup tables indexed
+# by outcome, built once from SYMBOLS / SYMBOL_WEIGHTS / PRIZES.
+if len(SYMBOL_WEIGHTS) != len(SYMBOLS):
+    raise ValueError("SYMBOL_WEIGHTS needs one weight per entry in SYMBOLS")
+
+NUM_SYMBOLS = len(SYMBOLS)
+NUM_OUTCOMES = NUM_SYMBOLS ** 3
+_REEL_CODES = range(NUM_SYMBOLS)
+_REEL_CUM_WEIGHTS = list(itertools.accumulate(SYMBOL_WEIGHTS))
+
+def encode_outcome(symbols) -> int:
+    c1, c2, c3 = (SYMBOLS.index(s) for s in symbols)
+    return (c1 * NUM_SYMBOLS + c2) * NUM_SYMBOLS + c3
+
+OUTCOME_SYMBOLS = [tuple(SYMBOLS[c] for c in combo) for combo in itertools.product(_REEL_CODES, repeat=3)]
+PAYOUTS = [0] * NUM_OUTCOMES
+for _combo, _reward in PRIZES.items():
+    PAYOUTS[encode_outcome(_combo)] = _reward
+
+def draw_outcomes(n: int) -> list:
+    """Draws n spins at once (3*n weighted reel stops) and returns their packed outcomes."""
+    codes = random.choices(_REEL_CODES, cum_weights=_REEL_CUM_WEIGHTS, k=3 * n)
+    it = iter(codes)
+    return [(c1 * NUM_SYMBOLS + c2) * NUM_SYMBOLS + c3 for c1, c2, c3 in zip(it, it, it)]
+
+# Stored spins use stable symbol codes from the symbols table (so history survives edits to
+# SYMBOLS), packed one byte per reel: (code1 << 16) | (code2 << 8) | code3.
+# Both tables are filled by load_symbol_codes() when the database opens.
+STORED_OUTCOMES = []     # engine outcome -> stored outcome
+SYMBOL_BY_CODE = {}      # stable code -> symbol, including symbols no longer on the reels
+
+def stored_symbols(stored: int) -> tuple:
+    """The three symbols of a stored outcome."""
+    return SYMBOL_BY_CODE[stored >> 16], SYMBOL_BY_CODE[(stored >> 8) & 0xFF], SYMBOL_BY_CODE[stored & 0xFF]
+
 # -------------------------
 # Bot setup
 # -------------------------
+class CasinoContext(commands.Context):
+    async def send(self, *args, **kwargs):
+        started = time.perf_counter()
+        try:
+            return await super().send(*args, **kwargs)
+        finally:
+            metrics.observe("casino_discord_send_seconds", time.perf_counter() - started, target="reply")
+
+class CasinoBot(commands.AutoShardedBot):
+    async def get_context(self, origin, *, cls=CasinoContext):
+        return await super().get_context(origin, cls=cls)
+
+    async def setup_hook(self):
+        # runs once per process, before the gateway connects (on_ready fires again on every reconnect)
+        await init_db()
+        self.loop_lag_task = asyncio.create_task(watch_loop_lag(), name="loop-lag")
+        if METRICS_PORT:
+            start_metrics_server(METRICS_HOST, METRICS_PORT)
+        if PROFILE_SAMPLING:
+            profiler.start(threading.get_ident())
+        if ANNOUNCE_CHANNEL_ID:
+            win_announcer.start(self, ANNOUNCE_CHANNEL_ID)
+        if writer_client is None:
+            # the process that owns the database runs the maintenance jobs
+            start_maintenance_loops()
+        # discord.py only handles SIGINT; make SIGTERM (launcher.py, systemd, docker stop) close cleanly too
+        try:
+            asyncio.get_running_loop().add_signal_handler(
+                signal.SIGTERM, lambda: setattr(self, "close_task", asyncio.create_task(self.close())))
+        except NotImplementedError:
+            pass    # Windows: no loop signal handlers
+
+    async def close(self):
+        # stop the gateway first so no new commands arrive, then flush and close the DB
+        stop_maintenance_loops()
+        profiler.stop()
+        if getattr(self, "loop_lag_task", None):
+            self.loop_lag_task.cancel()
+        await win_announcer.stop()
+        try:
+            await super().close()
+        finally:
+            await close_db()
+
 intents = discord.Intents.default()
 intents.message_content = True
-bot = commands.Bot(command_prefix="!", intents=intents)
+bot = CasinoBot(command_prefix="!", intents=intents, shard_count=SHARD_COUNT, shard_ids=SHARD_IDS)
+
+@bot.before_invoke
+async def _time_command_start(ctx):
+    ctx.metrics_started = time.perf_counter()
+
+@bot.after_invoke
+async def _time_command_end(ctx):
+    started = getattr(ctx, "metrics_started", None)
+    if started is not None:
+        metrics.observe("casino_command_seconds", time.perf_counter() - started,
+                        command=ctx.command.qualified_name, outcome="error" if ctx.command_failed else "ok")
+
+# -------------------------
+# Metrics / profiling
+# -------------------------
+LATENCY_BUCKETS = (0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+
+class Metrics:
+    """
+    In-process counters, gauges and latency histograms, rendered in Prometheus text format.
+    Updated from the event loop, read by the HTTP thread; a lock keeps the two consistent.
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._help = {}             # name -> (type, help text)
+        self._counters = {}         # (name, labels) -> value
+        self._histograms = {}       # (name, labels) -> [bucket counts..., sum, count]
+        self._gauges = {}           # name -> callable returning the current value
+
+    def describe(self, name: str, kind: str, text: str):
+        self._help[name] = (kind, text)
+
+    def inc(self, name: str, amount: float = 1, **labels):
+        key = (name, tuple(sorted(labels.items())))
+        with self._lock:
+            self._counters[key] = self._counters.get(key, 0) + amount
+
+    def observe(self, name: str, seconds: float, **labels):
+        key = (name, tuple(sorted(labels.items())))
+        with self._lock:
+            h = self._histograms.get(key)
+            if h is None:
+                h = self._histograms[key] = [0] * (len(LATENCY_BUCKETS) + 2)
+            for i, bound in enumerate(LATENCY_BUCKETS):
+                if seconds <= bound:
+                    h[i] += 1
+                    break
+            h[-2] += seconds
+            h[-1] += 1
+
+    def gauge(self, name: str, text: str, fn, kind: str = "gauge"):
+        """Registers a value read from fn() at scrape time (kind="counter" for running totals)."""
+        self.describe(name, kind, text)
+        self._gauges[name] = fn
+
+    @staticmethod
+    def _labels(labels, extra=()) -> str:
+        items = [f'{k}="{v}"' for k, v in (*labels, *extra)]
+        return "{" + ",".join(items) + "}" if items else ""
+
+    def render(self) -> str:
+        with self._lock:
+            counters = dict(self._counters)
+            histograms = {k: list(v) for k, v in self._histograms.items()}
+        by_name = defaultdict(list)
+        for (name, labels), value in counters.items():
+            by_name[name].append(f"{name}{self._labels(labels)} {value}")
+        for (name, labels), h in histograms.items():
+            cumulative = 0
+            for bound, n in zip(LATENCY_BUCKETS, h):
+                cumulative += n
+                by_name[name].append(f"{name}_bucket{self._labels(labels, (('le', bound),))} {cumulative}")
+            by_name[name].append(f"{name}_bucket{self._labels(labels, (('le', '+Inf'),))} {h[-1]}")
+            by_name[name].append(f"{name}_sum{self._labels(labels)} {h[-2]}")
+            by_name[name].append(f"{name}_count{self._labels(labels)} {h[-1]}")
+        for name, fn in self._gauges.items():
+            try:
+                by_name[name].append(f"{name} {fn()}")
+            except Exception:
+                pass
+        out = []
+        for name in sorted(by_name):
+            kind, text = self._help.get(name, ("untyped", name))
+            out.append(f"# HELP {name} {text}")
+            out.append(f"# TYPE {name} {kind}")
+            out.extend(by_name[name])
+        return "\n".join(out) + "\n"
+
+metrics = Metrics()
+metrics.describe("casino_command_seconds", "histogram", "Command latency by command and outcome")
+metrics.describe("casino_command_errors_total", "counter", "Commands that ended in on_command_error")
+metrics.describe("casino_db_query_seconds", "histogram", "SQLite statement latency by statement kind and table")
+metrics.describe("casino_db_commits_total", "counter", "SQLite commits")
+metrics.describe("casino_db_connections_opened_total", "counter", "SQLite connections opened")
+metrics.describe("casino_spin_flush_seconds", "histogram", "Group-commit flush latency of the spin writer")
+metrics.describe("casino_discord_send_seconds", "histogram", "Discord message send latency")
+metrics.describe("casino_loop_lag_seconds", "histogram", "How late the event loop ran a 0.5s timer")
+metrics.describe("casino_writer_call_seconds", "histogram", "Round trip of a shard's call to the DB writer, by operation")
+metrics.describe("casino_backup_seconds", "histogram", "Duration of a casino.db backup, copy through compression")
+metrics.gauge("casino_spin_queue_depth", "Spins waiting for the next group commit", lambda: spin_writer._queue.qsize() if spin_writer.running else 0)
+metrics.gauge("casino_spins_written_total", "Spins settled by the spin writer", lambda: spin_writer.spins_written, "counter")
+metrics.gauge("casino_balance_cache_hits_total", "Balance cache hits", lambda: balance_cache.hits, "counter")
+metrics.gauge("casino_balance_cache_misses_total", "Balance cache misses", lambda: balance_cache.misses, "counter")
+metrics.gauge("casino_balance_cache_size", "Users in the balance cache", lambda: len(balance_cache))
+metrics.gauge("casino_announce_queue_depth", "Win announcements waiting to be sent", lambda: win_announcer.depth)
+metrics.gauge("casino_announce_failures_total", "Win announcement sends that failed", lambda: win_announcer.send_failures, "counter")
+
+@lru_cache(maxsize=512)
+def query_label(sql: str) -> tuple:
+    """(statement kind, table) for a SQL string, e.g. ("select", "ledger")."""
+    words = sql.split(None, 1)
+    kind = words[0].lower() if words else "?"
+    m = re.search(r"\b(?:from|into|update|table|on)\s+(?:\w+\.)?(\w+)", sql, re.IGNORECASE)
+    return kind, (m.group(1) if m else "")
+
+class TimedConnection:
+    """Wraps an aiosqlite connection so every statement and commit is timed and counted."""
+
+    def __init__(self, db):
+        self._db = db
+
+    def __getattr__(self, name):
+        return getattr(self._db, name)
+
+    async def _timed(self, sql, coro):
+        started = time.perf_counter()
+        try:
+            return await coro
+        finally:
+            kind, table = query_label(sql)
+            metrics.observe("casino_db_query_seconds", time.perf_counter() - started, kind=kind, table=table)
+
+    async def execute(self, sql, params=()):
+        return await self._timed(sql, self._db.execute(sql, params))
+
+    async def executemany(self, sql, params):
+        return await self._timed(sql, self._db.executemany(sql, params))
+
+    async def execute_fetchall(self, sql, params=()):
+        return await self._timed(sql, self._db.execute_fetchall(sql, params))
+
+    async def commit(self):
+        await self._timed("COMMIT", self._db.commit())
+        metrics.inc("casino_db_commits_total")
+
+async def watch_loop_lag(period: float = 0.5):
+    loop = asyncio.get_running_loop()
+    while True:
+        started = loop.time()
+        await asyncio.sleep(period)
+        metrics.observe("casino_loop_lag_seconds", max(0.0, loop.time() - started - period))
+
+class SamplingProfiler:
+    """
+    Opt-in statistical profiler: a daemon thread snapshots the event-loop thread's stack every
+    `interval` seconds and counts stacks. Cheap enough to leave on briefly in production.
+    """
+
+    def __init__(self, interval: float):
+        self.interval = interval
+        self.samples = Counter()
+        self.total = 0
+        self._thread = None
+        self._stop = threading.Event()
+        self._target = None
+
+    @property
+    def running(self) -> bool:
+        return self._thread is not None
+
+    def start(self, thread_id: int):
+        if self.running:
+            return
+        self.samples.clear()
+        self.total = 0
+        self._target = thread_id
+        self._stop.clear()
+        self._thread = threading.Thread(target=self._run, name="sampling-profiler", daemon=True)
+        self._thread.start()
+
+    def stop(self):
+        if not self.running:
+            return
+        self._stop.set()
+        self._thread.join()
+        self._thread = None
+
+    def _run(self):
+        while not self._stop.wait(self.interval):
+            frame = sys._current_frames().get(self._target)
+            stack = []
+            while frame is not None:
+                code = frame.f_code
+                stack.append(f"{code.co_name} ({os.path.basename(code.co_filename)}:{frame.f_lineno})")
+                frame = frame.f_back
+            self.samples[";".join(reversed(stack))] += 1
+            self.total += 1
+
+    def report(self, top: int = 15) -> list:
+        """Frames the loop thread was executing (self time) as (percent of samples, frame), hottest first."""
+        leaves = Counter()
+        for stack, n in list(self.samples.items()):
+            leaves[stack.rsplit(";", 1)[-1]] += n
+        return [(n / self.total * 100, frame) for frame, n in leaves.most_common(top)] if self.total else []
+
+    def collapsed(self) -> str:
+        """All samples in collapsed-stack format (feed to flamegraph.pl / speedscope)."""
+        return "".join(f"{stack} {n}\n" for stack, n in list(self.samples.items()))
+
+profiler = SamplingProfiler(PROFILE_INTERVAL_MS / 1000)
+
+def start_metrics_server(host: str, port: int):
+    """Serves /metrics (and /profile) from a daemon thread so scrapes never touch the event loop."""
+    try:
+        from flask import Flask, Response
+        from werkzeug.serving import make_server
+    except ImportError:
+        print("METRICS_PORT is set but flask is not installed; metrics endpoint disabled.")
+        return
+    logging.getLogger("werkzeug").setLevel(logging.WARNING)   # no access log line per scrape
+    app = Flask("casino-metrics")
+
+    @app.route("/metrics")
+    def prometheus_metrics():
+        return Response(metrics.render(), mimetype="text/plain; version=0.0.4")
+
+    @app.route("/profile")
+    def profile_samples():
+        return Response(profiler.collapsed(), mimetype="text/plain")
+
+    server = make_server(host, port, app, threaded=True)
+    threading.Thread(target=server.serve_forever, name="metrics-http", daemon=True).start()
+    print(f"Metrics endpoint on http://{host}:{port}/metrics")
+
+# -------------------------
+# Database connection pool
+# -------------------------
+class ConnectionPool:
+    """
+    A fixed set of long-lived aiosqlite connections, opened once and handed out to helpers
+    and commands. Each connection runs in WAL mode so readers never block the writer.
+    Usage:  async with db_pool.acquire() as db: ...
+    """
+
+    def __init__(self, size: int):
+        self.size = size
+        self._conns = []
+        self._idle: Optional[asyncio.Queue] = None
+        self.readonly = False
+
+    @property
+    def is_open(self) -> bool:
+        return self._idle is not None
+
+    async def open(self, path: str, readonly: bool = False):
+        """readonly opens every connection with mode=ro (shard processes; the writer owns the file)."""
+        if self.is_open:
+            return
+        self.readonly = readonly
+        if readonly:
+            path = f"file:{urllib.parse.quote(os.path.abspath(path))}?mode=ro"
+        idle = asyncio.Queue()
+        for _ in range(self.size):
+            # uri=True lets archive files be ATTACHed read-only (file:...?mode=ro)
+            db = await aiosqlite.connect(path, uri=True)
+            metrics.inc("casino_db_connections_opened_total")
+            await db.execute(f"PRAGMA busy_timeout = {DB_BUSY_TIMEOUT_MS}")
+            if not readonly:
+                await db.execute("PRAGMA journal_mode = WAL")
+                await db.execute("PRAGMA synchronous = NORMAL")
+            self._conns.append(db)
+            idle.put_nowait(db)
+        self._idle = idle
+
+    @asynccontextmanager
+    async def acquire(self):
+        if not self.is_open:
+            raise RuntimeError("Database pool is not open; call init_db() first.")
+        db = await self._idle.get()
+        try:
+            yield TimedConnection(db)
+        finally:
+            # never hand out a connection with a half-finished transaction
+            if db.in_transaction:
+                await db.rollback()
+            self._idle.put_nowait(db)
+
+    async def close(self, timeout: float = 10.0):
+        if not self.is_open:
+            return
+        idle, self._idle = self._idle, None
+        # wait for in-flight commands to give their connections back before closing
+        try:
+            for _ in range(self.size):
+                await asyncio.wait_for(idle.get(), timeout)
+        except asyncio.TimeoutError:
+            print("Timed out waiting for DB connections to be released; closing anyway.")
+        conns, self._conns = self._conns, []
+        if conns and not self.readonly:
+            try:
+                await conns[0].execute("PRAGMA wal_checkpoint(TRUNCATE)")
+            except Exception as e:
+                print("WAL checkpoint failed on shutdown:", e)
+        for db in conns:
+            await db.close()
+
+db_pool = ConnectionPool(DB_POOL_SIZE)
+
+async def close_db():
+    if writer_client is not None:
+        await writer_client.close()
+    await spin_writer.stop()
+    await db_pool.close()
+    balance_cache.clear()
+
+# -------------------------
+# Writer service
+# -------------------------
+# In a sharded deployment only the writer process opens casino.db for writing. Every function
+# that changes the database is registered with @writer_op: in the writer (or a standalone bot)
+# it just runs, in a shard process the call is sent to the writer as one line of JSON over
+# WRITER_SOCKET and the result comes back the same way. Balance locks, the balance cache and
+# the spin group commit therefore all live in the writer, shared by every shard.
+WRITER_OPS = {}
+RPC_MESSAGE_LIMIT = 16 * 1024 * 1024     # largest request / reply line (bulk credit sheets)
+
+def writer_op(result_type=None):
+    """Registers a mutation. result_type rebuilds a NamedTuple result from its JSON list on shards."""
+    def register(fn):
+        WRITER_OPS[fn.__name__] = fn
+
+        @wraps(fn)
+        async def call(*args, **kwargs):
+            if writer_client is None:
+                return await fn(*args, **kwargs)
+            result = await writer_client.call(fn.__name__, args, kwargs)
+            return result_type(*result) if result_type and result is not None else result
+        return call
+    return register
+
+class WriterClient:
+    """A shard process's connection to the writer. Requests are pipelined on one socket."""
+
+    def __init__(self, path: str, connect_timeout: float = 30.0):
+        self.path = path
+        self.connect_timeout = connect_timeout
+        self._reader = None
+        self._writer = None
+        self._reader_task = None
+        self._pending = {}
+        self._ids = itertools.count(1)
+        self._connect_lock = asyncio.Lock()
+        self._write_lock = asyncio.Lock()
+
+    async def connect(self):
+        async with self._connect_lock:
+            if self._writer is not None:
+                return
+            deadline = time.monotonic() + self.connect_timeout
+            while True:
+                try:
+                    reader, writer = await asyncio.open_unix_connection(self.path, limit=RPC_MESSAGE_LIMIT)
+                    break
+                except (FileNotFoundError, ConnectionRefusedError):
+                    # the launcher may still be starting (or restarting) the writer
+                    if time.monotonic() >= deadline:
+                        raise
+                    await asyncio.sleep(0.2)
+            self._reader, self._writer = reader, writer
+            self._reader_task = asyncio.create_task(self._read_replies(reader), name="writer-client")
+
+    async def _read_replies(self, reader):
+        try:
+            while line := await reader.readline():
+                reply = json.loads(line)
+                fut = self._pending.pop(reply["id"], None)
+                if fut is None or fut.done():
+                    continue
+                if "error" in reply:
+                    fut.set_exception(RuntimeError(reply["error"]))
+                else:
+                    fut.set_result(reply["result"])
+        finally:
+            # the writer went away: fail what is in flight (it may or may not have committed)
+            # and reconnect on the next call; requests are never resent automatically
+            self._writer = None
+            pending, self._pending = self._pending, {}
+            for fut in pending.values():
+                if not fut.done():
+                    fut.set_exception(ConnectionError("lost the connection to the DB writer"))
+
+    async def call(self, op: str, args: tuple, kwargs: dict):
+        await self.connect()
+        request_id = next(self._ids)
+        fut = asyncio.get_running_loop().create_future()
+        self._pending[request_id] = fut
+        line = json.dumps({"id": request_id, "op": op, "args": args, "kwargs": kwargs}) + "\n"
+        started = time.perf_counter()
+        try:
+            async with self._write_lock:
+                if self._writer is None:
+                    raise ConnectionError("lost the connection to the DB writer")
+                self._writer.write(line.encode())
+                await self._writer.drain()
+            return await fut
+        finally:
+            self._pending.pop(request_id, None)
+            metrics.observe("casino_writer_call_seconds", time.perf_counter() - started, op=op)
+
+    async def close(self):
+        if self._reader_task:
+            self._reader_task.cancel()
+        if self._writer is not None:
+            self._writer.close()
+            self._writer = None
+
+writer_client = WriterClient(WRITER_SOCKET) if ROLE == "shard" else None
+
+async def _serve_shard(reader, writer):
+    write_lock = asyncio.Lock()
+    in_flight = set()
+
+    async def answer(request):
+        try:
+            result = await WRITER_OPS[request["op"]](*request["args"], **request["kwargs"])
+            reply = {"id": request["id"], "result": result}
+        except Exception as e:
+            reply = {"id": request["id"], "error": f"{type(e).__name__}: {e}"}
+        async with write_lock:
+            writer.write((json.dumps(reply) + "\n").encode())
+            await writer.drain()
+
+    try:
+        while line := await reader.readline():
+            # every request runs concurrently, so spins from all shards share group commits
+            task = asyncio.create_task(answer(json.loads(line)))
+            in_flight.add(task)
+            task.add_done_callback(in_flight.discard)
+    finally:
+        await asyncio.gather(*in_flight, return_exceptions=True)
+        writer.close()
+
+@writer_op()
+async def writer_stats() -> dict:
+    """Spin writer and balance cache counters, which only mean something in the writer."""
+    w, c = spin_writer, balance_cache
+    return {
+        "flushes": w.flushes, "spins_written": w.spins_written, "spins_rejected": w.spins_rejected,
+        "flush_errors": w.flush_errors, "last_flush_seconds": w.last_flush_seconds,
+        "total_flush_seconds": w.total_flush_seconds, "max_flush_seconds": w.max_flush_seconds,
+        "batch_size": w.batch_size, "flush_interval": w.flush_interval,
+        "cache_size": len(c), "cache_max_size": c.max_size, "cache_hits": c.hits,
+        "cache_misses": c.misses, "cache_evictions": c.evictions,
+    }
+
+def start_maintenance_loops():
+    if RECONCILE_INTERVAL > 0:
+        reconcile_loop.start()
+    if ARCHIVE_INTERVAL > 0:
+        archive_loop.start()
+    if BACKUP_INTERVAL > 0:
+        backup_loop.start()
+
+def stop_maintenance_loops():
+    reconcile_loop.cancel()
+    archive_loop.cancel()
+    backup_loop.cancel()
+
+async def run_writer():
+    """Writer process main: owns casino.db and serves shard processes until SIGTERM / SIGINT."""
+    await init_db()
+    loop_lag_task = asyncio.create_task(watch_loop_lag(), name="loop-lag")
+    if METRICS_PORT:
+        start_metrics_server(METRICS_HOST, METRICS_PORT)
+    if PROFILE_SAMPLING:
+        profiler.start(threading.get_ident())
+    start_maintenance_loops()
+    if os.path.exists(WRITER_SOCKET):
+        os.unlink(WRITER_SOCKET)
+    server = await asyncio.start_unix_server(_serve_shard, WRITER_SOCKET, limit=RPC_MESSAGE_LIMIT)
+    print(f"DB writer serving {DB_FILE} on {WRITER_SOCKET}")
+    stop = asyncio.Event()
+    for sig in (signal.SIGINT, signal.SIGTERM):
+        asyncio.get_running_loop().add_signal_handler(sig, stop.set)
+    await stop.wait()
+    server.close()
+    stop_maintenance_loops()
+    profiler.stop()
+    loop_lag_task.cancel()
+    # flushes the spins already queued before closing the pool
+    await close_db()
+    if os.path.exists(WRITER_SOCKET):
+        os.unlink(WRITER_SOCKET)
+
+# -------------------------
+# Database schema / migrations
+# -------------------------
+# Each migration runs once, in order, inside its own transaction; PRAGMA user_version records
+# how many have been applied. Append new migrations to the end — never edit or reorder old ones.
+async def _migration_base_schema(db):
+    await db.execute("""
+        CREATE TABLE IF NOT EXISTS users (
+            discord_id INTEGER PRIMARY KEY,
+            balance INTEGER DEFAULT 0,
+            kyc INTEGER DEFAULT 0,
+            created_at DATETIME DEFAULT CURRENT_TIMESTAMP
+        )
+    """)
+    await db.execute("""
+        CREATE TABLE IF NOT EXISTS ledger (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            discord_id INTEGER,
+            type TEXT,    -- deposit, bet, win, payout_request, payout_approved, payout_sent, admin_credit, refund
+            amount INTEGER, -- coins (+/-)
+            status TEXT,
+            metadata TEXT,
+            created_at DATETIME DEFAULT CURRENT_TIMESTAMP
+        )
+    """)
+    await db.execute("""
+        CREATE TABLE IF NOT EXISTS spins (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            discord_id INTEGER,
+            s1 TEXT, s2 TEXT, s3 TEXT,
+            won INTEGER,
+            ledger_id INTEGER,
+            created_at DATETIME DEFAULT CURRENT_TIMESTAMP
+        )
+    """)
+    await db.execute("""
+        CREATE TABLE IF NOT EXISTS cashouts (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            discord_id INTEGER,
+            paypal_email TEXT,
+            amount_coins INTEGER,
+            status TEXT DEFAULT 'queued', -- queued, approved, paid, rejected
+            ledger_request_id INTEGER,   -- ledger id for the reservation debit
+            created_at DATETIME DEFAULT CURRENT_TIMESTAMP
+        )
+    """)
+
+async def _migration_hot_query_indexes(db):
+    await db.execute("CREATE INDEX IF NOT EXISTS idx_spins_user_created ON spins (discord_id, created_at)")
+    await db.execute("CREATE INDEX IF NOT EXISTS idx_cashouts_user_created ON cashouts (discord_id, created_at)")
+    await db.execute("CREATE INDEX IF NOT EXISTS idx_cashouts_status_created ON cashouts (status, created_at)")
+    await db.execute("CREATE INDEX IF NOT EXISTS idx_ledger_created ON ledger (created_at)")
+
+async def _migration_export_filter_indexes(db):
+    # keyset pages walk the rowid; these let user/type filters seek instead of scanning
+    await db.execute("CREATE INDEX IF NOT EXISTS idx_ledger_user ON ledger (discord_id)")
+    await db.execute("CREATE INDEX IF NOT EXISTS idx_ledger_type ON ledger (type)")
+    await db.execute("CREATE INDEX IF NOT EXISTS idx_spins_user ON spins (discord_id)")
+
+async def _migration_reconcile_checkpoints(db):
+    await db.execute("""
+        CREATE TABLE IF NOT EXISTS reconcile_checkpoints (
+            discord_id INTEGER PRIMARY KEY,
+            ledger_balance INTEGER,     -- balance implied by the ledger up to last_ledger_id
+            last_ledger_id INTEGER,
+            checked_at DATETIME DEFAULT CURRENT_TIMESTAMP
+        )
+    """)
+    await db.execute("""
+        CREATE TABLE IF NOT EXISTS reconcile_state (
+            id INTEGER PRIMARY KEY CHECK (id = 1),
+            last_ledger_id INTEGER,     -- high-water mark: ledger rows up to here are checkpointed
+            checked_at DATETIME DEFAULT CURRENT_TIMESTAMP
+        )
+    """)
+    await db.execute("INSERT OR IGNORE INTO reconcile_state (id,last_ledger_id) VALUES (1, 0)")
+
+async def _migration_user_stats(db):
+    # per-user totals kept current by the spin writer and !markpaid, so !stats never aggregates history
+    await db.execute("""
+        CREATE TABLE IF NOT EXISTS user_stats (
+            discord_id INTEGER PRIMARY KEY,
+            spins INTEGER DEFAULT 0,
+            total_wagered INTEGER DEFAULT 0,    -- coins bet
+            total_won INTEGER DEFAULT 0,        -- coins paid out by spins
+            biggest_win INTEGER DEFAULT 0,      -- best single spin
+            total_cashed_out INTEGER DEFAULT 0, -- coins in cashouts marked paid
+            updated_at DATETIME DEFAULT CURRENT_TIMESTAMP
+        )
+    """)
+    await db.execute("CREATE INDEX IF NOT EXISTS idx_user_stats_net ON user_stats (total_won - total_wagered)")
+    await backfill_user_stats(db)
+
+async def _migration_archive_catalog(db):
+    await db.execute("""
+        CREATE TABLE IF NOT EXISTS archives (
+            month TEXT PRIMARY KEY,      -- YYYY-MM of the rows' created_at
+            path TEXT,
+            ledger_first INTEGER,        -- id ranges held by the file, so reads can skip it
+            ledger_last INTEGER,
+            spins_first INTEGER,
+            spins_last INTEGER,
+            ledger_rows INTEGER DEFAULT 0,
+            spin_rows INTEGER DEFAULT 0,
+            archived_at DATETIME DEFAULT CURRENT_TIMESTAMP
+        )
+    """)
+    # archival moves spins together with the ledger rows they point at
+    await db.execute("CREATE INDEX IF NOT EXISTS idx_spins_ledger ON spins (ledger_id)")
+
+def _split_metadata(text: Optional[str]) -> tuple:
+    """
+    Splits an old free-text metadata string into (request_id, admin_id, paypal, rest).
+    Spin metadata (spin_cost, symbols:...) is dropped: the spins row holds the outcome.
+    """
+    request_id = admin_id = paypal = None
+    rest = []
+    parts = (text or "").split(";")
+    for i, part in enumerate(parts):
+        key, _, value = part.partition(":")
+        if paypal is not None and key != "request":
+            # emails were never validated: a ';' inside one belongs to it, up to the request part
+            paypal += ";" + part
+            continue
+        if key == "reason":
+            # free text, may contain ';' itself
+            rest.append(";".join(parts[i:]))
+            break
+        if key == "request" and value.isdigit():
+            request_id = int(value)
+        elif key in ("admin", "credited_by") and value.isdigit():
+            admin_id = int(value)
+        elif key == "paypal" and value:
+            paypal = value
+        elif part and key != "symbols" and part != "spin_cost":
+            rest.append(part)
+    return request_id, admin_id, paypal, ";".join(rest) or None
+
+async def _compact_spins_table(db, codes: dict, autoincrement: bool):
+    """Rewrites spins (s1, s2, s3 TEXT) as one packed outcome INTEGER. No-op if already done."""
+    if "outcome" in [r[1] for r in await db.execute_fetchall("PRAGMA table_info(spins)")]:
+        return
+    await db.execute("CREATE TEMP TABLE symbol_codes (symbol TEXT PRIMARY KEY, code INTEGER)")
+    await db.executemany("INSERT INTO temp.symbol_codes (symbol,code) VALUES (?,?)", codes.items())
+    await db.execute(f"""
+        CREATE TABLE spins_compact (
+            id INTEGER PRIMARY KEY{" AUTOINCREMENT" if autoincrement else ""},
+            discord_id INTEGER,
+            outcome INTEGER,   -- (code1 << 16) | (code2 << 8) | code3, codes from the symbols table
+            won INTEGER,
+            ledger_id INTEGER,
+            created_at DATETIME DEFAULT CURRENT_TIMESTAMP
+        )
+    """)
+    await db.execute("""
+        INSERT INTO spins_compact (id,discord_id,outcome,won,ledger_id,created_at)
+        SELECT s.id, s.discord_id, (c1.code << 16) | (c2.code << 8) | c3.code, s.won, s.ledger_id, s.created_at
+        FROM spins s
+        LEFT JOIN temp.symbol_codes c1 ON c1.symbol = s.s1
+        LEFT JOIN temp.symbol_codes c2 ON c2.symbol = s.s2
+        LEFT JOIN temp.symbol_codes c3 ON c3.symbol = s.s3
+    """)
+    await db.execute("DROP TABLE spins")
+    await db.execute("ALTER TABLE spins_compact RENAME TO spins")
+    await db.execute("DROP TABLE temp.symbol_codes")
+
+async def _compact_ledger_table(db, request_ledger_ids: list):
+    """
+    Adds the typed request_id / admin_id / paypal columns and moves those values out of
+    metadata. request_ledger_ids are (ledger id, cashout id) of payout_request rows, which never
+    named their request. No-op if already done.
+    """
+    if "request_id" in [r[1] for r in await db.execute_fetchall("PRAGMA table_info(ledger)")]:
+        return
+    await db.execute("ALTER TABLE ledger ADD COLUMN request_id INTEGER")
+    await db.execute("ALTER TABLE ledger ADD COLUMN admin_id INTEGER")
+    await db.execute("ALTER TABLE ledger ADD COLUMN paypal TEXT")
+    cursor = 0
+    while True:
+        rows = await db.execute_fetchall("SELECT id, metadata FROM ledger WHERE id > ? ORDER BY id LIMIT 10000", (cursor,))
+        if not rows:
+            break
+        await db.executemany("UPDATE ledger SET request_id = ?, admin_id = ?, paypal = ?, metadata = ? WHERE id = ?",
+                             [(*_split_metadata(metadata), row_id) for row_id, metadata in rows])
+        cursor = rows[-1][0]
+    await db.executemany("UPDATE ledger SET request_id = ? WHERE id = ?",
+                         [(cashout_id, ledger_id) for ledger_id, cashout_id in request_ledger_ids])
+
+async def register_symbols(db, symbols):
+    """Gives every symbol not yet in the symbols table the next free code."""
+    for symbol in symbols:
+        await db.execute("INSERT OR IGNORE INTO symbols (code,symbol) SELECT COALESCE(MAX(code) + 1, 0), ? FROM symbols",
+                         (symbol,))
+    if (await db.execute_fetchall("SELECT MAX(code) FROM symbols"))[0][0] > 0xFF:
+        raise ValueError("more than 256 distinct symbols cannot be packed into a stored outcome")
+
+async def _migration_compact_storage(db):
+    await db.execute("CREATE TABLE IF NOT EXISTS symbols (code INTEGER PRIMARY KEY, symbol TEXT UNIQUE NOT NULL)")
+    # today's reels first, so their codes match the engine's order; then symbols only history has
+    seen = [r[0] for r in await db.execute_fetchall("SELECT s1 FROM spins UNION SELECT s2 FROM spins UNION SELECT s3 FROM spins")]
+    await register_symbols(db, SYMBOLS + [s for s in seen if s is not None and s not in SYMBOLS])
+    codes = dict(await db.execute_fetchall("SELECT symbol, code FROM symbols"))
+    await _compact_spins_table(db, codes, autoincrement=True)
+    await db.execute("CREATE INDEX IF NOT EXISTS idx_spins_user_created ON spins (discord_id, created_at)")
+    await db.execute("CREATE INDEX IF NOT EXISTS idx_spins_user ON spins (discord_id)")
+    await db.execute("CREATE INDEX IF NOT EXISTS idx_spins_ledger ON spins (ledger_id)")
+    request_ledger_ids = await db.execute_fetchall("SELECT ledger_request_id, id FROM cashouts WHERE ledger_request_id IS NOT NULL")
+    await _compact_ledger_table(db, request_ledger_ids)
+    await db.execute("CREATE INDEX IF NOT EXISTS idx_ledger_request ON ledger (request_id) WHERE request_id IS NOT NULL")
+    await db.execute("CREATE INDEX IF NOT EXISTS idx_ledger_admin ON ledger (admin_id) WHERE admin_id IS NOT NULL")
+    # archive files get the same rewrite; each step checks the file first, so a rerun is safe
+    for (path,) in await db.execute_fetchall("SELECT path FROM archives ORDER BY month"):
+        if not os.path.exists(path):
+            print(f"WARNING: archive file {path} is missing; it was not converted")
+            continue
+        async with aiosqlite.connect(path) as archive:
+            await archive.execute("BEGIN IMMEDIATE")
+            await _compact_spins_table(archive, codes, autoincrement=False)
+            await _compact_ledger_table(archive, request_ledger_ids)
+            for statement in ARCHIVE_SCHEMA:
+                await archive.execute(statement.format(schema="main"))
+            await archive.commit()
+            await archive.execute("VACUUM")
+# the rewritten tables leave free pages behind; run_migrations VACUUMs afterwards
+_migration_compact_storage.reclaims_space = True
+
+MIGRATIONS = [
+    _migration_base_schema,             # 1
+    _migration_hot_query_indexes,       # 2
+    _migration_export_filter_indexes,   # 3
+    _migration_reconcile_checkpoints,   # 4
+    _migration_user_stats,              # 5
+    _migration_archive_catalog,         # 6
+    _migration_compact_storage,         # 7
+]
+
+async def run_migrations(db):
+    rows = await db.execute_fetchall("PRAGMA user_version")
+    version = rows[0][0]
+    vacuum = False
+    for target, migration in enumerate(MIGRATIONS[version:], start=version + 1):
+        await db.execute("BEGIN IMMEDIATE")
+        await migration(db)
+        await db.execute(f"PRAGMA user_version = {target}")
+        await db.commit()
+        print(f"DB migrated to version {target} ({migration.__name__})")
+        vacuum = vacuum or getattr(migration, "reclaims_space", False)
+    # databases from before user_version (version 0) with data need this as much as any
+    if vacuum and (await db.execute_fetchall("PRAGMA freelist_count"))[0][0] > 0:
+        # VACUUM cannot run inside the migration's transaction
+        await db.execute("VACUUM")
+        print("DB vacuumed")
+
+def _stats_history_sql(schema: str) -> str:
+    """Per-user (spins, wagered, won, biggest, cashed) parts from one database's spins and ledger."""
+    return f"""
+        SELECT discord_id, COUNT(*) AS spins, 0 AS wagered, SUM(won) AS won, MAX(won) AS biggest, 0 AS cashed
+        FROM {schema}.spins GROUP BY discord_id
+        UNION ALL
+        SELECT discord_id, 0, -SUM(amount), 0, 0, 0 FROM {schema}.ledger WHERE type = 'bet' GROUP BY discord_id
+    """
+
+async def backfill_user_stats(db, archived: bool = False):
+    """
+    Rebuilds user_stats from spins, bet ledger rows and paid cashouts. The caller holds the
+    write transaction; run by the migration that adds the table and by rebuild_user_stats(),
+    which passes archived=True after collecting the archive files' parts in temp.archived_stats.
+    """
+    sources = [_stats_history_sql("main"),
+               "SELECT discord_id, 0, 0, 0, 0, SUM(amount_coins) FROM main.cashouts WHERE status = 'paid' GROUP BY discord_id"]
+    if archived:
+        sources.append("SELECT discord_id, spins, wagered, won, biggest, cashed FROM temp.archived_stats")
+    await db.execute("DELETE FROM user_stats")
+    await db.execute(f"""
+        INSERT INTO user_stats (discord_id, spins, total_wagered, total_won, biggest_win, total_cashed_out)
+        SELECT discord_id, SUM(spins), SUM(wagered), SUM(won), MAX(biggest), SUM(cashed) FROM (
+            {" UNION ALL ".join(sources)}
+        ) GROUP BY discord_id
+    """)
+
+# also run against archive files, with schema set to the attached archive
+LASTSPINS_SQL = "SELECT outcome,won,created_at FROM {schema}.spins WHERE discord_id = ? ORDER BY created_at DESC LIMIT ?"
+
+# Queries run by commands on every call. check_query_plans() makes sure none of them
+# full-scans a table or sorts in a temp b-tree as the tables grow.
+HOT_QUERIES = {
+    "status": ("SELECT id,paypal_email,amount_coins,status,created_at FROM cashouts WHERE discord_id = ? ORDER BY created_at DESC LIMIT 10", (0,)),
+    "list_requests": ("SELECT id,discord_id,paypal_email,amount_coins,status,created_at FROM cashouts WHERE status = 'queued' ORDER BY created_at ASC", ()),
+    "lastspins": (LASTSPINS_SQL.format(schema="main"), (0, 5)),
+    # +type keeps the planner on idx_ledger_user (a few rows per user) rather than every user's carry row
+    "has_archive_carry": ("SELECT 1 FROM ledger WHERE discord_id = ? AND +type = ? LIMIT 1", (0, "archive_carry")),
+    "stats": ("SELECT spins,total_wagered,total_won,biggest_win,total_cashed_out FROM user_stats WHERE discord_id = ?", (0,)),
+    "leaderboard": ("SELECT discord_id,total_won - total_wagered,spins FROM user_stats WHERE spins > 0 ORDER BY total_won - total_wagered DESC LIMIT ?", (10,)),
+}
+
+async def check_query_plans(db) -> list:
+    """
+    Runs EXPLAIN QUERY PLAN over HOT_QUERIES. Returns (name, plan detail) for every step
+    that scans a table without an index or needs a temp b-tree for ORDER BY.
+    """
+    problems = []
+    for name, (sql, params) in HOT_QUERIES.items():
+        for row in await db.execute_fetchall("EXPLAIN QUERY PLAN " + sql, params):
+            detail = row[3]
+            full_scan = detail.startswith("SCAN") and "INDEX" not in detail
+            if full_scan or "TEMP B-TREE" in detail:
+                problems.append((name, detail))
+    return problems
 
 # -------------------------
 # Database initialization
 # -------------------------
-async def init_db():
-    async with aiosqlite.connect(DB_FILE) as db:
-        await db.execute("""
-            CREATE TABLE IF NOT EXISTS users (
-                discord_id INTEGER PRIMARY KEY,
-                balance INTEGER DEFAULT 0,
-                kyc INTEGER DEFAULT 0,
-                created_at DATETIME DEFAULT CURRENT_TIMESTAMP
-            )
-        """)
-        await db.execute("""
-            CREATE TABLE IF NOT EXISTS ledger (
-                id INTEGER PRIMARY KEY AUTOINCREMENT,
-                discord_id INTEGER,
-                type TEXT,    -- deposit, bet, win, payout_request, payout_approved, payout_sent, admin_credit, refund
-                amount INTEGER, -- coins (+/-)
-                status TEXT,
-                metadata TEXT,
-                created_at DATETIME DEFAULT CURRENT_TIMESTAMP
-            )
-        """)
-        await db.execute("""
-            CREATE TABLE IF NOT EXISTS spins (
-                id INTEGER PRIMARY KEY AUTOINCREMENT,
-                discord_id INTEGER,
-                s1 TEXT, s2 TEXT, s3 TEXT,
-                won INTEGER,
-                ledger_id INTEGER,
-                created_at DATETIME DEFAULT CURRENT_TIMESTAMP
-            )
-        """)
-        await db.execute("""
-            CREATE TABLE IF NOT EXISTS cashouts (
-                id INTEGER PRIMARY KEY AUTOINCREMENT,
-                discord_id INTEGER,
-                paypal_email TEXT,
-                amount_coins INTEGER,
-                status TEXT DEFAULT 'queued', -- queued, approved, paid, rejected
-                ledger_request_id INTEGER,   -- ledger id for the reservation debit
-                created_at DATETIME DEFAULT CURRENT_TIMESTAMP
-            )
-        """)
+async def load_symbol_codes(db):
+    """Fills SYMBOL_BY_CODE and STORED_OUTCOMES, registering new SYMBOLS first unless read-only."""
+    if not db_pool.readonly:
+        await register_symbols(db, SYMBOLS)
         await db.commit()
+    SYMBOL_BY_CODE.clear()
+    SYMBOL_BY_CODE.update(await db.execute_fetchall("SELECT code, symbol FROM symbols"))
+    code = {symbol: c for c, symbol in SYMBOL_BY_CODE.items()}
+    STORED_OUTCOMES[:] = [(code[a] << 16) | (code[b] << 8) | code[c] for a, b, c in OUTCOME_SYMBOLS]
+
+async def init_db():
+    """
+    Opens the pool, applies pending migrations and starts the spin writer. Safe to call twice.
+    In a shard process it connects to the writer and opens the pool read-only instead.
+    """
+    if db_pool.is_open:
+        return
+    if writer_client is not None:
+        # the writer has migrated the schema by the time it accepts connections
+        await writer_client.connect()
+        await db_pool.open(DB_FILE, readonly=True)
+        async with db_pool.acquire() as db:
+            await load_symbol_codes(db)
+        return
+    await db_pool.open(DB_FILE)
+    async with db_pool.acquire() as db:
+        await run_migrations(db)
+        await load_symbol_codes(db)
+        for name, detail in await check_query_plans(db):
+            print(f"WARNING: hot query '{name}' is not index-backed: {detail}")
+    spin_writer.start()
+
+# -------------------------
+# Balance cache
+# -------------------------
+class BalanceCache:
+    """
+    Authoritative in-process copy of users.balance, keyed by discord_id and loaded lazily.
+    Every balance change holds the user's lock, commits to SQLite and then updates the cache
+    (write-through), so a cached value is never behind the database. LRU-bounded to max_size.
+    """
+
+    def __init__(self, max_size: int):
+        self.max_size = max_size
+        self._balances = OrderedDict()
+        # locks live as long as someone holds or waits on them
+        self._locks = weakref.WeakValueDictionary()
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+    def __len__(self):
+        return len(self._balances)
+
+    def lock(self, discord_id: int) -> asyncio.Lock:
+        lock = self._locks.get(discord_id)
+        if lock is None:
+            lock = asyncio.Lock()
+            self._locks[discord_id] = lock
+        return lock
+
+    def get(self, discord_id: int) -> Optional[int]:
+        bal = self._balances.get(discord_id)
+        if bal is None:
+            self.misses += 1
+            return None
+        self.hits += 1
+        self._balances.move_to_end(discord_id)
+        return bal
+
+    def put(self, discord_id: int, balance: int):
+        self._balances[discord_id] = balance
+        self._balances.move_to_end(discord_id)
+        while len(self._balances) > self.max_size:
+            self._balances.popitem(last=False)
+            self.evictions += 1
+
+    def discard(self, discord_id: int):
+        self._balances.pop(discord_id, None)
+
+    def clear(self):
+        self._balances.clear()
+
+balance_cache = BalanceCache(BALANCE_CACHE_SIZE)
 
 # -------------------------
 # DB helper functions
 # -------------------------
-async def ensure_user(discord_id: int):
-    async with aiosqlite.connect(DB_FILE) as db:
-        await db.execute("INSERT OR IGNORE INTO users (discord_id,balance) VALUES (?, ?)", (discord_id, 0))
-        await db.commit()
+# Ledger types written for the audit trail only; they do not move users.balance
+# (the coins already left the balance with the payout_request row).
+AUDIT_ONLY_LEDGER_TYPES = ("payout_approved", "payout_sent")
+# One per user in the hot ledger: the net of their balance-moving rows that were archived
+ARCHIVE_CARRY_TYPE = "archive_carry"
 
-async def get_balance(discord_id: int) -> int:
-    await ensure_user(discord_id)
-    async with aiosqlite.connect(DB_FILE) as db:
+async def _load_balance(discord_id: int) -> int:
+    # caller must hold balance_cache.lock(discord_id)
+    bal = balance_cache.get(discord_id)
+    if bal is not None:
+        return bal
+    async with db_pool.acquire() as db:
         cur = await db.execute("SELECT balance FROM users WHERE discord_id = ?", (discord_id,))
         row = await cur.fetchone()
-        return row[0] if row else 0
+        if row is None:
+            await db.execute("INSERT OR IGNORE INTO users (discord_id,balance) VALUES (?, ?)", (discord_id, 0))
+            await db.commit()
+        bal = row[0] if row else 0
+    balance_cache.put(discord_id, bal)
+    return bal
 
-async def change_balance_with_ledger(discord_id: int, amount_coins: int, ltype: str, metadata: Optional[str] = None):
+async def get_balance(discord_id: int) -> int:
+    if writer_client is not None:
+        # shard process: the writer commits before it updates its cache, so the database is as fresh
+        async with db_pool.acquire() as db:
+            rows = await db.execute_fetchall("SELECT balance FROM users WHERE discord_id = ?", (discord_id,))
+        return rows[0][0] if rows else 0
+    async with balance_cache.lock(discord_id):
+        return await _load_balance(discord_id)
+
+@writer_op()
+async def change_balance_with_ledger(discord_id: int, amount_coins: int, ltype: str, metadata: Optional[str] = None,
+                                     admin_id: Optional[int] = None):
     """
     Adds ledger row and updates balance (coins). amount_coins can be negative.
+    admin_id records the admin who made the change, if any.
     Returns ledger id.
     """
-    async with aiosqlite.connect(DB_FILE) as db:
-        cur = await db.execute("INSERT INTO ledger (discord_id,type,amount,status,metadata) VALUES (?,?,?,?,?)",
-                               (discord_id, ltype, amount_coins, "completed", metadata or ""))
-        await db.execute("UPDATE users SET balance = balance + ? WHERE discord_id = ?", (amount_coins, discord_id))
+    async with balance_cache.lock(discord_id):
+        async with db_pool.acquire() as db:
+            await db.execute("INSERT OR IGNORE INTO users (discord_id,balance) VALUES (?, ?)", (discord_id, 0))
+            cur = await db.execute("INSERT INTO ledger (discord_id,type,amount,status,metadata,admin_id) VALUES (?,?,?,?,?,?)",
+                                   (discord_id, ltype, amount_coins, "completed", metadata or None, admin_id))
+            rows = await db.execute_fetchall("UPDATE users SET balance = balance + ? WHERE discord_id = ? RETURNING balance",
+                                             (amount_coins, discord_id))
+            await db.commit()
+        balance_cache.put(discord_id, rows[0][0])
+        return cur.lastrowid
+
+@writer_op()
+async def request_cashout(discord_id: int, paypal_email: str, amount_coins: Optional[int]):
+    """
+    Reserves coins for a cashout: payout_request ledger row, balance debit and queued cashouts row
+    in one transaction. amount_coins=None cashes out the full balance.
+    Returns (cashout_id, amount_coins, balance_before); cashout_id is None if nothing was reserved.
+    """
+    async with balance_cache.lock(discord_id):
+        bal = await _load_balance(discord_id)
+        if amount_coins is None:
+            amount_coins = bal
+        if bal <= 0 or amount_coins <= 0 or amount_coins > bal:
+            return None, amount_coins, bal
+        async with db_pool.acquire() as db:
+            cur = await db.execute("INSERT INTO ledger (discord_id,type,amount,status,paypal) VALUES (?,?,?,?,?)",
+                                   (discord_id, "payout_request", -amount_coins, "completed", paypal_email))
+            ledger_request_id = cur.lastrowid
+            rows = await db.execute_fetchall("UPDATE users SET balance = balance - ? WHERE discord_id = ? RETURNING balance",
+                                             (amount_coins, discord_id))
+            cur = await db.execute("INSERT INTO cashouts (discord_id,paypal_email,amount_coins,status,ledger_request_id) VALUES (?,?,?,?,?)",
+                                   (discord_id, paypal_email, amount_coins, "queued", ledger_request_id))
+            await db.execute("UPDATE ledger SET request_id = ? WHERE id = ?", (cur.lastrowid, ledger_request_id))
+            await db.commit()
+        balance_cache.put(discord_id, rows[0][0])
+        return cur.lastrowid, amount_coins, bal
+
+@writer_op()
+async def approve_cashout(request_id: int, admin_id: int):
+    """
+    Marks a queued cashout approved and writes the payout_approved audit row.
+    Returns (id, discord_id, paypal_email, amount_coins, status) as found before, or None if missing.
+    """
+    async with db_pool.acquire() as db:
+        await db.execute("BEGIN IMMEDIATE")
+        cur = await db.execute("SELECT id,discord_id,paypal_email,amount_coins,status FROM cashouts WHERE id = ?", (request_id,))
+        row = await cur.fetchone()
+        if not row or row[4] != "queued":
+            await db.rollback()
+            return row
+        await db.execute("UPDATE cashouts SET status = 'approved' WHERE id = ?", (request_id,))
+        await db.execute("INSERT INTO ledger (discord_id,type,amount,status,request_id,admin_id,paypal) VALUES (?,?,?,?,?,?,?)",
+                         (row[1], "payout_approved", -row[3], "completed", request_id, admin_id, row[2]))
         await db.commit()
-        lid = (await db.execute("SELECT last_insert_rowid()")).fetchone
-        # sqlite's aiosqlite cursor handling: fetch last_insert_rowid by query
-        cur2 = await db.execute("SELECT last_insert_rowid()")
-        row = await cur2.fetchone()
-        return row[0] if row else None
-
-async def add_ledger_only(discord_id: int, amount_coins: int, ltype: str, metadata: Optional[str] = None):
-    async with aiosqlite.connect(DB_FILE) as db:
-        await db.execute("INSERT INTO ledger (discord_id,type,amount,status,metadata) VALUES (?,?,?,?,?)",
-                         (discord_id, ltype, amount_coins, "completed", metadata or ""))
+    return row
+
+@writer_op()
+async def mark_cashout_paid(request_id: int, admin_id: int):
+    """
+    Marks a cashout paid, writes the payout_sent audit row and adds it to user_stats.
+    Returns (id, discord_id, amount_coins, status) as found before, or None if missing.
+    """
+    async with db_pool.acquire() as db:
+        await db.execute("BEGIN IMMEDIATE")
+        cur = await db.execute("SELECT id,discord_id,amount_coins,status FROM cashouts WHERE id = ?", (request_id,))
+        row = await cur.fetchone()
+        if not row or row[3] == "paid":
+            await db.rollback()
+            return row
+        # Allow markpaid from approved or queued (but ideally approved)
+        await db.execute("UPDATE cashouts SET status = 'paid' WHERE id = ?", (request_id,))
+        await db.execute("INSERT INTO ledger (discord_id,type,amount,status,request_id,admin_id) VALUES (?,?,?,?,?,?)",
+                         (row[1], "payout_sent", -row[2], "completed", request_id, admin_id))
+        await db.execute(UPSERT_CASHOUT_STATS, (row[1], row[2]))
         await db.commit()
-        cur = await db.execute("SELECT last_insert_rowid()")
+    return row
+
+@writer_op()
+async def reject_cashout(request_id: int, reason: str):
+    """
+    Rejects a queued cashout and refunds the reserved coins in one transaction.
+    Returns (id, discord_id, amount_coins, status) as found before rejecting, or None if missing.
+    Only requests whose status was 'queued' are changed.
+    """
+    async with db_pool.acquire() as db:
+        cur = await db.execute("SELECT id,discord_id,amount_coins,status FROM cashouts WHERE id = ?", (request_id,))
         row = await cur.fetchone()
-        return row[0] if row else None
+    if not row or row[3] != "queued":
+        return row
+    async with balance_cache.lock(row[1]):
+        async with db_pool.acquire() as db:
+            await db.execute("BEGIN IMMEDIATE")
+            # re-check under the write lock in case another admin got there first
+            cur = await db.execute("SELECT id,discord_id,amount_coins,status FROM cashouts WHERE id = ?", (request_id,))
+            row = await cur.fetchone()
+            if row[3] != "queued":
+                await db.rollback()
+                return row
+            rows = await db.execute_fetchall("UPDATE users SET balance = balance + ? WHERE discord_id = ? RETURNING balance",
+                                             (row[2], row[1]))
+            await db.execute("INSERT INTO ledger (discord_id,type,amount,status,metadata,request_id) VALUES (?,?,?,?,?,?)",
+                             (row[1], "payout_rejected_refund", row[2], "completed", f"reason:{reason}", request_id))
+            await db.execute("UPDATE cashouts SET status = 'rejected' WHERE id = ?", (request_id,))
+            await db.commit()
+        balance_cache.put(row[1], rows[0][0])
+    return row
+
+# -------------------------
+# Spin engine
+# -------------------------
+class SpinResult(NamedTuple):
+    symbols: tuple
+    won: int
+    ledger_id: int      # win / spin_result ledger row referenced by the spin
+    balance: int        # balance after the spin settled
+
+class MultiSpinResult(NamedTuple):
+    outcomes: list      # packed outcomes, see draw_outcomes()
+    total_won: int
+    ledger_id: int      # win / spin_result ledger row referenced by every spin in the batch
+    balance: int
+
+class SpinWriter:
+    """
+    Group-commit write-behind queue for spins. Commands submit drawn outcomes and await a
+    future; a background task gathers pending jobs from every in-flight command and settles
+    them in one transaction (conditional debit + credit per job, ledger and spins rows via
+    executemany) every flush_interval seconds or batch_size jobs, whichever comes first.
+    Futures resolve only after the commit, so the balance a user sees is always durable.
+
+    A job is one user's spins: a bet and a result ledger row plus one spins row per outcome.
+    """
+
+    def __init__(self, batch_size: int, flush_interval: float):
+        self.batch_size = batch_size
+        self.flush_interval = flush_interval
+        self._queue: Optional[asyncio.Queue] = None
+        self._full = asyncio.Event()
+        self._task: Optional[asyncio.Task] = None
+        # counters
+        self.flushes = 0
+        self.spins_written = 0
+        self.spins_rejected = 0
+        self.flush_errors = 0
+        self.last_flush_seconds = 0.0
+        self.max_flush_seconds = 0.0
+        self.total_flush_seconds = 0.0
+
+    @property
+    def running(self) -> bool:
+        return self._task is not None
+
+    def start(self):
+        if self.running:
+            return
+        self._queue = asyncio.Queue()
+        self._task = asyncio.create_task(self._run(), name="spin-writer")
+
+    async def stop(self):
+        if not self.running:
+            return
+        task, self._task = self._task, None
+        # submit() refuses new jobs from here on; _run finishes the flush in progress, settles
+        # everything queued ahead of the None sentinel and exits
+        self._queue.put_nowait(None)
+        self._full.set()
+        await task
+
+    async def submit(self, discord_id: int, outcomes: list) -> Optional[tuple]:
+        """Queues outcomes for one user. Returns (result ledger id, new balance), or None if the balance is too low."""
+        if not self.running:
+            raise RuntimeError("Spin writer is not running; call init_db() first.")
+        fut = asyncio.get_running_loop().create_future()
+        self._queue.put_nowait((discord_id, outcomes, fut))
+        if self._queue.qsize() >= self.batch_size:
+            self._full.set()
+        return await fut
+
+    async def _run(self):
+        while True:
+            job = await self._queue.get()
+            if job is None:
+                return
+            batch = [job]
+            if self._queue.qsize() < self.batch_size - 1:
+                self._full.clear()
+                try:
+                    await asyncio.wait_for(self._full.wait(), self.flush_interval)
+                except asyncio.TimeoutError:
+                    pass
+            stopping = False
+            while len(batch) < self.batch_size and not self._queue.empty():
+                job = self._queue.get_nowait()
+                if job is None:
+                    stopping = True
+                    break
+                batch.append(job)
+            await self._flush(batch)
+            if stopping:
+                return
+
+    async def _flush(self, batch):
+        started = time.perf_counter()
+        try:
+            results = await self._write(batch)
+        except BaseException as e:
+            # the transaction was rolled back; fail every waiting command rather than leave it hanging
+            self.flush_errors += 1
+            print("Spin flush failed:", repr(e))
+            error = e if isinstance(e, Exception) else RuntimeError("spin flush was cancelled")
+            for *_, fut in batch:
+                if not fut.done():
+                    fut.set_exception(error)
+            if not isinstance(e, Exception):
+                raise
+            return
+        elapsed = time.perf_counter() - started
+        metrics.observe("casino_spin_flush_seconds", elapsed)
+        self.flushes += 1
+        self.last_flush_seconds = elapsed
+        self.total_flush_seconds += elapsed
+        self.max_flush_seconds = max(self.max_flush_seconds, elapsed)
+        for (_, outcomes, fut), result in zip(batch, results):
+            if result is None:
+                self.spins_rejected += len(outcomes)
+            else:
+                self.spins_written += len(outcomes)
+            if not fut.done():
+                fut.set_result(result)
+
+    async def _write(self, batch) -> list:
+        results = []
+        ledger_rows = []
+        async with db_pool.acquire() as db:
+            # take the write lock up front so concurrent writers queue instead of racing balance checks
+            await db.execute("BEGIN IMMEDIATE")
+            await db.executemany("INSERT OR IGNORE INTO users (discord_id,balance) VALUES (?, 0)",
+                                 {(job[0],) for job in batch})
+            for discord_id, outcomes, _ in batch:
+                cost = SPIN_COST * len(outcomes)
+                won = sum(PAYOUTS[o] for o in outcomes)
+                rows = await db.execute_fetchall(
+                    "UPDATE users SET balance = balance - ? + ? WHERE discord_id = ? AND balance >= ? RETURNING balance",
+                    (cost, won, discord_id, cost))
+                if not rows:
+                    results.append(None)
+                    continue
+                if len(outcomes) == 1:
+                    # the spins row referencing the result row holds the symbols
+                    bet_meta = result_meta = None
+                else:
+                    wins = sum(1 for o in outcomes if PAYOUTS[o])
+                    bet_meta, result_meta = f"multispin:{len(outcomes)}", f"multispin:{len(outcomes)};wins:{wins}"
+                ledger_rows.append((discord_id, "bet", -cost, "completed", bet_meta))
+                # spin_result ledger row for audit when nothing was won
+                ledger_rows.append((discord_id, "win" if won > 0 else "spin_result", won, "completed", result_meta))
+                results.append(rows[0][0])
+            if not ledger_rows:
+                await db.rollback()
+                return results
+            await db.executemany("INSERT INTO ledger (discord_id,type,amount,status,metadata) VALUES (?,?,?,?,?)",
+                                 ledger_rows)
+            # we hold the write lock, so AUTOINCREMENT ids of this batch are contiguous
+            last_id = (await db.execute_fetchall("SELECT last_insert_rowid()"))[0][0]
+            ledger_id = last_id - len(ledger_rows) + 2
+            spin_rows = []
+            stats_rows = []
+            for i, (discord_id, outcomes, _) in enumerate(batch):
+                if results[i] is None:
+                    continue
+                spin_rows.extend((discord_id, STORED_OUTCOMES[o], PAYOUTS[o], ledger_id) for o in outcomes)
+                payouts = [PAYOUTS[o] for o in outcomes]
+                stats_rows.append((discord_id, len(outcomes), SPIN_COST * len(outcomes), sum(payouts), max(payouts)))
+                results[i] = (ledger_id, results[i])
+                ledger_id += 2
+            await db.executemany("INSERT INTO spins (discord_id,outcome,won,ledger_id) VALUES (?,?,?,?)",
+                                 spin_rows)
+            await db.executemany(UPSERT_SPIN_STATS, stats_rows)
+            await db.commit()
+        return results
+
+# one row per settled job; a user with several jobs in a batch just gets several upserts
+UPSERT_SPIN_STATS = """
+    INSERT INTO user_stats (discord_id, spins, total_wagered, total_won, biggest_win) VALUES (?,?,?,?,?)
+    ON CONFLICT(discord_id) DO UPDATE SET
+        spins = spins + excluded.spins,
+        total_wagered = total_wagered + excluded.total_wagered,
+        total_won = total_won + excluded.total_won,
+        biggest_win = MAX(biggest_win, excluded.biggest_win),
+        updated_at = CURRENT_TIMESTAMP
+"""
+UPSERT_CASHOUT_STATS = """
+    INSERT INTO user_stats (discord_id, total_cashed_out) VALUES (?, ?)
+    ON CONFLICT(discord_id) DO UPDATE SET
+        total_cashed_out = total_cashed_out + excluded.total_cashed_out, updated_at = CURRENT_TIMESTAMP
+"""
+
+spin_writer = SpinWriter(SPIN_BATCH_SIZE, SPIN_FLUSH_MS / 1000)
+
+async def _settle_spins(discord_id: int, outcomes: list) -> Optional[tuple]:
+    # caller holds balance_cache.lock(discord_id)
+    settled = await spin_writer.submit(discord_id, outcomes)
+    if settled is None:
+        # the cache disagreed with the database; reload on next use
+        balance_cache.discard(discord_id)
+    else:
+        balance_cache.put(discord_id, settled[1])
+    return settled
+
+@writer_op(SpinResult)
+async def play_spin(discord_id: int) -> Optional[SpinResult]:
+    """
+    Draws one spin and hands it to the group-commit writer. Returns once the debit, ledger rows,
+    prize credit and spins row are committed, or None (and changes nothing) if the balance is too low.
+    """
+    # one spin per user at a time; the cached balance rejects broke spins without touching the DB
+    async with balance_cache.lock(discord_id):
+        if await _load_balance(discord_id) < SPIN_COST:
+            return None
+        outcome = draw_outcomes(1)[0]
+        settled = await _settle_spins(discord_id, [outcome])
+    if settled is None:
+        return None
+    return SpinResult(OUTCOME_SYMBOLS[outcome], PAYOUTS[outcome], *settled)
+
+@writer_op(MultiSpinResult)
+async def play_multispin(discord_id: int, count: int) -> Optional[MultiSpinResult]:
+    """
+    Draws up to count spins at once (as many as the balance covers) and settles them as one job:
+    a single bet and result ledger row for the totals plus one spins row per outcome.
+    Returns None if the balance does not cover a single spin.
+    """
+    async with balance_cache.lock(discord_id):
+        count = min(count, await _load_balance(discord_id) // SPIN_COST)
+        if count <= 0:
+            return None
+        outcomes = draw_outcomes(count)
+        settled = await _settle_spins(discord_id, outcomes)
+    if settled is None:
+        return None
+    return MultiSpinResult(outcomes, sum(PAYOUTS[o] for o in outcomes), *settled)
+
+# -------------------------
+# Win announcements
+# -------------------------
+class WinAnnouncer:
+    """
+    Posts public win announcements from a background task so spins never wait on Discord.
+    Wins queue up (bounded) and are coalesced into as few messages as fit in Discord's 2000-char
+    limit, at most one message per `interval` seconds. When the queue is full new wins are not
+    queued; they are merged into a "...and N more wins" line on the next message instead.
+    """
+
+    MESSAGE_LIMIT = 1900    # headroom under Discord's 2000 chars
+
+    def __init__(self, max_queue: int, interval: float):
+        self.max_queue = max_queue
+        self.interval = interval
+        self._queue: Optional[asyncio.Queue] = None
+        self._task: Optional[asyncio.Task] = None
+        self._client = None
+        self._channel_id = None
+        self._channel = None
+        self._carry = None
+        self._overflow_wins = 0
+        self._overflow_coins = 0
+        # counters
+        self.queued = 0
+        self.sent_messages = 0
+        self.sent_wins = 0
+        self.merged = 0
+        self.send_failures = 0
+
+    @property
+    def depth(self) -> int:
+        return self._queue.qsize() if self._queue else 0
+
+    def start(self, client, channel_id: int):
+        if self._task is not None:
+            return
+        self._client = client
+        self._channel_id = channel_id
+        self._queue = asyncio.Queue(self.max_queue)
+        self._task = asyncio.create_task(self._run(), name="win-announcer")
+
+    async def stop(self):
+        if self._task is None:
+            return
+        task, self._task = self._task, None
+        task.cancel()
+        try:
+            await task
+        except asyncio.CancelledError:
+            pass
+
+    def announce(self, line: str, coins: int):
+        """Queues one win line. Never blocks; a no-op when no announce channel is configured."""
+        if self._task is None:
+            return
+        try:
+            self._queue.put_nowait(line)
+            self.queued += 1
+        except asyncio.QueueFull:
+            self._overflow_wins += 1
+            self._overflow_coins += coins
+            self.merged += 1
+
+    async def _resolve_channel(self):
+        if self._channel is None:
+            self._channel = self._client.get_channel(self._channel_id) or await self._client.fetch_channel(self._channel_id)
+        return self._channel
+
+    def _next_message(self, first: str) -> list:
+        lines, size = [first], len(first)
+        while not self._queue.empty():
+            line = self._queue.get_nowait()
+            if size + len(line) + 1 > self.MESSAGE_LIMIT:
+                self._carry = line
+                break
+            lines.append(line)
+            size += len(line) + 1
+        if self._overflow_wins:
+            lines.append(f"…and {self._overflow_wins} more wins ({self._overflow_coins} coins, {coins_to_pounds(self._overflow_coins)})")
+            self._overflow_wins = self._overflow_coins = 0
+        return lines
+
+    async def _run(self):
+        loop = asyncio.get_running_loop()
+        last_sent = 0.0
+        while True:
+            if self._carry is not None:
+                first, self._carry = self._carry, None
+            else:
+                first = await self._queue.get()
+            # stay under the channel rate limit; wins arriving meanwhile join this message
+            await asyncio.sleep(max(0.0, last_sent + self.interval - loop.time()))
+            merged = self._overflow_wins
+            lines = self._next_message(first)
+            wins = len(lines) - (1 if merged else 0) + merged
+            last_sent = loop.time()
+            try:
+                ch = await self._resolve_channel()
+                send_started = time.perf_counter()
+                await ch.send("\n".join(lines))
+                metrics.observe("casino_discord_send_seconds", time.perf_counter() - send_started, target="announce")
+                self.sent_messages += 1
+                self.sent_wins += wins
+            except Exception as e:
+                # drop this message rather than back up spins; re-resolve the channel next time
+                self.send_failures += 1
+                self._channel = None
+                print(f"Win announcement failed ({wins} wins dropped):", e)
+
+win_announcer = WinAnnouncer(ANNOUNCE_QUEUE_SIZE, ANNOUNCE_INTERVAL)
+
+# -------------------------
+# Keyset paging / exports
+# -------------------------
+# table -> (columns, column the type= filter applies to)
+EXPORT_TABLES = {
+    "ledger": (("id", "discord_id", "type", "amount", "status", "request_id", "admin_id", "paypal", "metadata",
+                "created_at"), "type"),
+    "spins": (("id", "discord_id", "outcome", "won", "ledger_id", "created_at"), None),
+    "cashouts": (("id", "discord_id", "paypal_email", "amount_coins", "status", "ledger_request_id", "created_at"), "status"),
+}
+
+def page_query(table: str, filters: dict, descending: bool = False, schema: str = "main") -> tuple:
+    """
+    SQL for one keyset page of `table`: rows after the cursor id (before it when descending),
+    matching filters user / type / request / admin / since / until (created_at, until exclusive).
+    schema selects an attached archive instead of casino.db. Params are (*filter values, cursor, limit).
+    """
+    columns, type_column = EXPORT_TABLES[table]
+    clauses, params = [], []
+    if "user" in filters:
+        clauses.append("discord_id = ?")
+        params.append(filters["user"])
+    if "type" in filters and type_column:
+        clauses.append(f"{type_column} = ?")
+        params.append(filters["type"])
+    for key, column in (("request", "request_id"), ("admin", "admin_id")):
+        if key in filters and column in columns:
+            clauses.append(f"{column} = ?")
+            params.append(filters[key])
+    if "since" in filters:
+        clauses.append("created_at >= ?")
+        params.append(filters["since"])
+    if "until" in filters:
+        clauses.append("created_at < ?")
+        params.append(filters["until"])
+    clauses.append("id < ?" if descending else "id > ?")
+    sql = (f"SELECT {','.join(columns)} FROM {schema}.{table} WHERE {' AND '.join(clauses)} "
+           f"ORDER BY id {'DESC' if descending else 'ASC'} LIMIT ?")
+    return sql, params
+
+def unsupported_filters(table: str, filters: dict) -> list:
+    """The filters page_query() would ignore for `table` (type= needs a type column, request= / admin= the ledger)."""
+    columns, type_column = EXPORT_TABLES[table]
+    needs = {"type": type_column, "request": "request_id", "admin": "admin_id"}
+    return [key for key in filters if key in needs and (needs[key] is None or needs[key] not in columns)]
+
+async def fetch_page(table: str, filters: dict, cursor: Optional[int], limit: int, descending: bool = False) -> list:
+    """
+    One keyset page. cursor=None starts from the oldest row (newest when descending).
+    Archived ledger / spins rows are included: every archived id is older than the hot rows,
+    so a page walks the archive files before casino.db (after it when descending).
+    """
+    if cursor is None:
+        cursor = (1 << 63) - 1 if descending else 0
+    sql, params = page_query(table, filters, descending)
+    async with db_pool.acquire() as db:
+        if table not in ARCHIVED_TABLES:
+            return await db.execute_fetchall(sql, (*params, cursor, limit))
+        archives = await archive_catalog(db, table)
+        sources = [None] + archives[::-1] if descending else archives + [None]
+        rows = []
+        for source in sources:
+            if source is None:
+                rows += await db.execute_fetchall(sql, (*params, cursor, limit - len(rows)))
+            else:
+                _, path, first, last = source
+                if first is None or (first >= cursor if descending else last <= cursor):
+                    continue
+                async with attach_archive(db, path) as schema:
+                    archive_sql = page_query(table, filters, descending, schema)[0]
+                    rows += await db.execute_fetchall(archive_sql, (*params, cursor, limit - len(rows)))
+            if len(rows) >= limit:
+                break
+        return rows
+
+HOT_QUERIES.update({
+    "ledger": (page_query("ledger", {}, descending=True)[0], ((1 << 63) - 1, 20)),
+    "export_ledger_user": (page_query("ledger", {"user": 0})[0], (0, 0, EXPORT_PAGE_SIZE)),
+    "export_ledger_type": (page_query("ledger", {"type": ""})[0], ("", 0, EXPORT_PAGE_SIZE)),
+    "export_spins_user": (page_query("spins", {"user": 0})[0], (0, 0, EXPORT_PAGE_SIZE)),
+    "ledger_request": (page_query("ledger", {"request": 0}, descending=True)[0], (0, (1 << 63) - 1, 20)),
+    "ledger_admin": (page_query("ledger", {"admin": 0}, descending=True)[0], (0, (1 << 63) - 1, 20)),
+})
+
+def parse_export_options(options) -> tuple:
+    """
+    Parses key=value words for !export / !ledger. Returns (filters, fmt, compress, error).
+    """
+    filters, fmt, compress = {}, "csv", False
+    for opt in options:
+        key, _, value = opt.partition("=")
+        key = key.lower()
+        if key in ("gzip", "gz"):
+            compress = True
+        elif key == "format" and value.lower() in ("csv", "jsonl"):
+            fmt = value.lower()
+        elif key == "user" and value.strip("<@!>").isdigit():
+            filters["user"] = int(value.strip("<@!>"))
+        elif key == "type" and value:
+            filters["type"] = value
+        elif key == "request" and value.lstrip("#").isdigit():
+            filters["request"] = int(value.lstrip("#"))
+        elif key == "admin" and value.strip("<@!>").isdigit():
+            filters["admin"] = int(value.strip("<@!>"))
+        elif key in ("since", "until") and value:
+            try:
+                filters[key] = datetime.fromisoformat(value).strftime("%Y-%m-%d %H:%M:%S")
+            except ValueError:
+                return None, fmt, compress, f"Bad date for {key}: `{value}` (use YYYY-MM-DD or YYYY-MM-DDTHH:MM:SS)"
+        else:
+            return None, fmt, compress, f"Unknown option `{opt}`."
+    return filters, fmt, compress, None
+
+def _open_export(path: str, compress: bool):
+    if compress:
+        return gzip.open(path, "wt", encoding="utf-8", newline="")
+    return open(path, "w", encoding="utf-8", newline="")
+
+def export_columns(table: str) -> tuple:
+    """Columns as written to an export file: spins show their three symbols, not the packed outcome."""
+    columns = EXPORT_TABLES[table][0]
+    if table == "spins":
+        i = columns.index("outcome")
+        return columns[:i] + ("s1", "s2", "s3") + columns[i + 1:]
+    return columns
+
+def export_rows(table: str, rows: list) -> list:
+    if table != "spins":
+        return rows
+    return [(r[0], r[1], *stored_symbols(r[2]), *r[3:]) for r in rows]
+
+def _write_export_rows(fh, fmt: str, columns: tuple, rows: list):
+    if fmt == "csv":
+        csv.writer(fh).writerows(rows)
+    else:
+        fh.writelines(json.dumps(dict(zip(columns, row)), ensure_ascii=False) + "\n" for row in rows)
+
+async def export_table(table: str, filters: dict, fmt: str = "csv", compress: bool = False) -> tuple:
+    """
+    Streams every matching row of `table` to a CSV/JSONL file (optionally gzip) in a private
+    temp directory, one keyset page at a time, so memory stays flat however long the history is.
+    File writes run in a worker thread. Returns (path, rows written); the caller must
+    discard_export() or keep_export() the file, which holds emails and user ids.
+    """
+    columns = export_columns(table)
+    stamp = datetime.now().strftime("%Y%m%d-%H%M%S")
+    directory = await asyncio.to_thread(tempfile.mkdtemp, prefix="casino-export-")
+    path = os.path.join(directory, f"{table}-{stamp}.{fmt}" + (".gz" if compress else ""))
+    written = 0
+    try:
+        fh = await asyncio.to_thread(_open_export, path, compress)
+        try:
+            if fmt == "csv":
+                await asyncio.to_thread(csv.writer(fh).writerow, columns)
+            cursor = 0
+            while True:
+                rows = await fetch_page(table, filters, cursor, EXPORT_PAGE_SIZE)
+                if not rows:
+                    break
+                await asyncio.to_thread(_write_export_rows, fh, fmt, columns, export_rows(table, rows))
+                written += len(rows)
+                cursor = rows[-1][0]
+        finally:
+            await asyncio.to_thread(fh.close)
+    except BaseException:
+        await asyncio.to_thread(shutil.rmtree, directory, True)
+        raise
+    return path, written
+
+def discard_export(path: str):
+    """Deletes an export_table() file and its temp directory."""
+    shutil.rmtree(os.path.dirname(path), ignore_errors=True)
+
+def keep_export(path: str) -> str:
+    """Moves an export_table() file into EXPORT_DIR, where it stays until someone deletes it. Returns the new path."""
+    os.makedirs(EXPORT_DIR, exist_ok=True)
+    kept = os.path.join(EXPORT_DIR, os.path.basename(path))
+    n = 1
+    while os.path.exists(kept):
+        n += 1
+        stem, dot, ext = os.path.basename(path).partition(".")
+        kept = os.path.join(EXPORT_DIR, f"{stem}-{n}{dot}{ext}")
+    shutil.move(path, kept)
+    discard_export(path)
+    return kept
+
+async def send_lines(ctx, lines: list, limit: int = 1900):
+    """Sends lines as few messages as possible without splitting a line across messages."""
+    chunk, size = [], 0
+    for line in lines:
+        if len(line) > limit:
+            line = line[:limit - 1] + "…"
+        if chunk and size + len(line) + 1 > limit:
+            await ctx.send("\n".join(chunk))
+            chunk, size = [], 0
+        chunk.append(line)
+        size += len(line) + 1
+    if chunk:
+        await ctx.send("\n".join(chunk))
+
+# -------------------------
+# Reconciliation
+# -------------------------
+# users.balance should always equal the sum of that user's balance-moving ledger rows.
+# Rather than re-summing the whole ledger, each run starts from per-user checkpoints
+# (ledger-implied balance up to a high-water mark) and only reads ledger rows added since.
+class ReconcileReport(NamedTuple):
+    from_id: int        # ledger rows in (from_id, to_id] were processed
+    to_id: int
+    rows: int
+    users: int
+    mismatches: list    # (discord_id, users.balance, ledger-implied balance)
+    seconds: float
+
+_reconcile_lock = asyncio.Lock()
+last_reconcile: Optional[ReconcileReport] = None
+
+@writer_op(ReconcileReport)
+async def reconcile(full: bool = False) -> ReconcileReport:
+    """
+    Checks every user with ledger activity since the last run against their checkpoint and
+    advances the checkpoints. full=True ignores existing checkpoints and rebuilds them.
+    """
+    global last_reconcile
+    async with _reconcile_lock:
+        started = time.perf_counter()
+        # carry rows restate archived history the checkpoints already hold, so only a full
+        # run (which starts from zero) counts them
+        skip_types = AUDIT_ONLY_LEDGER_TYPES if full else AUDIT_ONLY_LEDGER_TYPES + (ARCHIVE_CARRY_TYPE,)
+        skip = ",".join("?" * len(skip_types))
+        async with db_pool.acquire() as db:
+            # one read snapshot, so balances and ledger rows are seen as of the same commit
+            await db.execute("BEGIN")
+            from_id = 0 if full else (await db.execute_fetchall("SELECT last_ledger_id FROM reconcile_state WHERE id = 1"))[0][0]
+            to_id = (await db.execute_fetchall("SELECT COALESCE(MAX(id), 0) FROM ledger"))[0][0]
+            deltas = await db.execute_fetchall(
+                f"SELECT discord_id, SUM(amount), COUNT(*) FROM ledger WHERE id > ? AND id <= ? AND type NOT IN ({skip}) GROUP BY discord_id",
+                (from_id, to_id, *skip_types))
+            touched = json.dumps([d[0] for d in deltas])
+            balances = dict((r[0], r[1:]) for r in await db.execute_fetchall(
+                "SELECT u.discord_id, u.balance, c.ledger_balance FROM users u "
+                "LEFT JOIN reconcile_checkpoints c ON c.discord_id = u.discord_id "
+                "WHERE u.discord_id IN (SELECT value FROM json_each(?))", (touched,)))
+            await db.rollback()
+
+        mismatches, checkpoints = [], []
+        for discord_id, delta, _ in deltas:
+            balance, base = balances.get(discord_id, (0, None))
+            expected = delta + (0 if full or base is None else base)
+            checkpoints.append((discord_id, expected, to_id))
+            if balance != expected:
+                mismatches.append((discord_id, balance, expected))
+
+        async with db_pool.acquire() as db:
+            await db.execute("BEGIN IMMEDIATE")
+            if full:
+                await db.execute("DELETE FROM reconcile_checkpoints")
+            await db.executemany(
+                "INSERT INTO reconcile_checkpoints (discord_id,ledger_balance,last_ledger_id,checked_at) VALUES (?,?,?,CURRENT_TIMESTAMP) "
+                "ON CONFLICT(discord_id) DO UPDATE SET ledger_balance = excluded.ledger_balance, "
+                "last_ledger_id = excluded.last_ledger_id, checked_at = excluded.checked_at", checkpoints)
+            await db.execute("UPDATE reconcile_state SET last_ledger_id = ?, checked_at = CURRENT_TIMESTAMP WHERE id = 1", (to_id,))
+            await db.commit()
+
+        last_reconcile = ReconcileReport(from_id, to_id, sum(d[2] for d in deltas), len(deltas), mismatches,
+                                         time.perf_counter() - started)
+        for discord_id, balance, expected in mismatches:
+            print(f"RECONCILE MISMATCH: user {discord_id} balance {balance} but ledger says {expected}")
+        return last_reconcile
+
+@writer_op(ReconcileReport)
+async def get_last_reconcile() -> Optional[ReconcileReport]:
+    return last_reconcile
+
+@tasks.loop(seconds=RECONCILE_INTERVAL or 900)
+async def reconcile_loop():
+    try:
+        await reconcile()
+    except Exception as e:
+        print("Background reconciliation failed:", e)
+
+# -------------------------
+# Archive storage
+# -------------------------
+# Ledger and spins rows older than ARCHIVE_AFTER_DAYS move to one SQLite file per month in
+# ARCHIVE_DIR, listed in the archives table. Each user's archived balance-moving rows are
+# summed into a single archive_carry ledger row left in casino.db, so balances still equal
+# the hot ledger and reconciliation never has to open an archive. Only rows already covered
+# by the reconcile checkpoints are archived. Reads ATTACH archive files read-only on demand.
+ARCHIVED_TABLES = ("ledger", "spins")
+
+ARCHIVE_SCHEMA = [
+    "CREATE TABLE IF NOT EXISTS {schema}.ledger (id INTEGER PRIMARY KEY, discord_id INTEGER, type TEXT, amount INTEGER, "
+    "status TEXT, metadata TEXT, created_at DATETIME, request_id INTEGER, admin_id INTEGER, paypal TEXT)",
+    "CREATE TABLE IF NOT EXISTS {schema}.spins (id INTEGER PRIMARY KEY, discord_id INTEGER, outcome INTEGER, "
+    "won INTEGER, ledger_id INTEGER, created_at DATETIME)",
+    "CREATE INDEX IF NOT EXISTS {schema}.idx_ledger_user ON ledger (discord_id)",
+    "CREATE INDEX IF NOT EXISTS {schema}.idx_ledger_type ON ledger (type)",
+    "CREATE INDEX IF NOT EXISTS {schema}.idx_ledger_request ON ledger (request_id) WHERE request_id IS NOT NULL",
+    "CREATE INDEX IF NOT EXISTS {schema}.idx_ledger_admin ON ledger (admin_id) WHERE admin_id IS NOT NULL",
+    "CREATE INDEX IF NOT EXISTS {schema}.idx_spins_user_created ON spins (discord_id, created_at)",
+    "CREATE INDEX IF NOT EXISTS {schema}.idx_spins_user ON spins (discord_id)",
+]
+
+class ArchiveReport(NamedTuple):
+    months: list        # YYYY-MM files written to
+    ledger_rows: int
+    spin_rows: int
+    users: int          # users whose archive_carry row was updated
+    through_id: int     # ledger ids up to here are archived
+    seconds: float
+
+_archive_lock = asyncio.Lock()
+last_archive: Optional[ArchiveReport] = None
+
+async def archive_catalog(db, table: Optional[str] = None) -> list:
+    """
+    Archive files, oldest first: (month, path, first id, last id) of table's rows, or with
+    table=None (month, path, ledger rows, spin rows, archived_at).
+    """
+    if table is None:
+        return await db.execute_fetchall(
+            "SELECT month,path,ledger_rows,spin_rows,archived_at FROM archives ORDER BY month")
+    return await db.execute_fetchall(
+        f"SELECT month,path,{table}_first,{table}_last FROM archives ORDER BY month")
+
+@asynccontextmanager
+async def attach_archive(db, path: str, readonly: bool = True):
+    """ATTACHes an archive file for the block and yields its schema name. Not inside a transaction."""
+    target = f"file:{urllib.parse.quote(os.path.abspath(path))}?mode=ro" if readonly else path
+    await db.execute("ATTACH DATABASE ? AS archive", (target,))
+    try:
+        yield "archive"
+    finally:
+        if db.in_transaction:
+            await db.rollback()
+        await db.execute("DETACH DATABASE archive")
+
+async def recent_spins(discord_id: int, limit: int) -> list:
+    """The user's newest spins, topped up from the archive files (newest month first) if needed."""
+    async with db_pool.acquire() as db:
+        rows = await db.execute_fetchall(HOT_QUERIES["lastspins"][0], (discord_id, limit))
+        # archived spins imply archived bets, and those always leave the user an archive_carry row
+        if len(rows) < limit and await db.execute_fetchall(HOT_QUERIES["has_archive_carry"][0], (discord_id, ARCHIVE_CARRY_TYPE)):
+            for _, path, first, _ in reversed(await archive_catalog(db, "spins")):
+                if first is None:
+                    continue
+                async with attach_archive(db, path) as schema:
+                    rows += await db.execute_fetchall(LASTSPINS_SQL.format(schema=schema), (discord_id, limit - len(rows)))
+                if len(rows) >= limit:
+                    break
+    return rows
+
+async def _archive_range(db, schema: str, month: str, path: str, lo: int, hi: int) -> tuple:
+    """
+    Moves ledger ids lo..hi and their spins into the attached archive. Returns (ledger rows, spin rows, users).
+
+    Two transactions, archive first: SQLite does not commit a WAL-mode main database and an
+    attached file atomically, so the rows are copied (INSERT OR IGNORE) and made durable in the
+    archive before a second transaction on casino.db checks they are there and deletes them.
+    A run interrupted anywhere simply runs again.
+    """
+    ledger_cols = ",".join(EXPORT_TABLES["ledger"][0])
+    spin_cols = ",".join(EXPORT_TABLES["spins"][0])
+    await db.execute(f"PRAGMA {schema}.synchronous = FULL")
+    await db.execute("BEGIN")
+    await db.execute(
+        f"INSERT OR IGNORE INTO {schema}.ledger ({ledger_cols}) SELECT {ledger_cols} FROM main.ledger "
+        "WHERE id BETWEEN ? AND ? AND type != ?", (lo, hi, ARCHIVE_CARRY_TYPE))
+    await db.execute(f"INSERT OR IGNORE INTO {schema}.spins ({spin_cols}) SELECT {spin_cols} FROM main.spins "
+                     "WHERE ledger_id BETWEEN ? AND ?", (lo, hi))
+    await db.commit()
+
+    await db.execute("BEGIN IMMEDIATE")
+    missing = (await db.execute_fetchall(
+        f"SELECT (SELECT COUNT(*) FROM main.ledger l WHERE l.id BETWEEN ? AND ? AND l.type != ? "
+        f"        AND NOT EXISTS (SELECT 1 FROM {schema}.ledger a WHERE a.id = l.id)),"
+        f"       (SELECT COUNT(*) FROM main.spins s WHERE s.ledger_id BETWEEN ? AND ? "
+        f"        AND NOT EXISTS (SELECT 1 FROM {schema}.spins a WHERE a.id = s.id))",
+        (lo, hi, ARCHIVE_CARRY_TYPE, lo, hi)))[0]
+    if any(missing):
+        await db.rollback()
+        raise RuntimeError(f"{missing[0]} ledger rows and {missing[1]} spins of ids {lo}-{hi} are missing from {path}; "
+                           "nothing was deleted")
+    ledger_rows = (await db.execute_fetchall("SELECT COUNT(*) FROM main.ledger WHERE id BETWEEN ? AND ? AND type != ?",
+                                             (lo, hi, ARCHIVE_CARRY_TYPE)))[0][0]
+    spin_first, spin_last, spin_rows = (await db.execute_fetchall(
+        "SELECT MIN(id), MAX(id), COUNT(*) FROM main.spins WHERE ledger_id BETWEEN ? AND ?", (lo, hi)))[0]
+
+    # fold the range (including any older carry rows in it) and the users' newer carry rows into one carry each
+    skip = ",".join("?" * len(AUDIT_ONLY_LEDGER_TYPES))
+    carries = dict(await db.execute_fetchall(
+        f"SELECT discord_id, SUM(amount) FROM main.ledger WHERE id BETWEEN ? AND ? AND type NOT IN ({skip}) GROUP BY discord_id",
+        (lo, hi, *AUDIT_ONLY_LEDGER_TYPES)))
+    touched = json.dumps(list(carries))
+    for discord_id, amount in await db.execute_fetchall(
+            "SELECT discord_id, SUM(amount) FROM main.ledger WHERE type = ? AND id > ? "
+            "AND discord_id IN (SELECT value FROM json_each(?)) GROUP BY discord_id", (ARCHIVE_CARRY_TYPE, hi, touched)):
+        carries[discord_id] += amount
+    await db.execute("DELETE FROM main.spins WHERE ledger_id BETWEEN ? AND ?", (lo, hi))
+    await db.execute("DELETE FROM main.ledger WHERE id BETWEEN ? AND ?", (lo, hi))
+    await db.execute("DELETE FROM main.ledger WHERE type = ? AND id > ? AND discord_id IN (SELECT value FROM json_each(?))",
+                     (ARCHIVE_CARRY_TYPE, hi, touched))
+    await db.executemany("INSERT INTO ledger (discord_id,type,amount,status,metadata) VALUES (?,?,?,?,?)",
+                         [(discord_id, ARCHIVE_CARRY_TYPE, amount, "completed", f"archived_through:{hi}")
+                          for discord_id, amount in carries.items()])
+    await db.execute("""
+        INSERT INTO archives (month,path,ledger_first,ledger_last,spins_first,spins_last,ledger_rows,spin_rows)
+        VALUES (?,?,?,?,?,?,?,?)
+        ON CONFLICT(month) DO UPDATE SET
+            ledger_first = MIN(ledger_first, excluded.ledger_first),
+            ledger_last = MAX(ledger_last, excluded.ledger_last),
+            spins_first = MIN(COALESCE(spins_first, excluded.spins_first), COALESCE(excluded.spins_first, spins_first)),
+            spins_last = MAX(COALESCE(spins_last, excluded.spins_last), COALESCE(excluded.spins_last, spins_last)),
+            ledger_rows = ledger_rows + excluded.ledger_rows,
+            spin_rows = spin_rows + excluded.spin_rows,
+            archived_at = CURRENT_TIMESTAMP
+    """, (month, path, lo, hi, spin_first, spin_last, ledger_rows, spin_rows))
+    await db.commit()
+    return ledger_rows, spin_rows, set(carries)
+
+@writer_op(ArchiveReport)
+async def archive_old_rows(max_age_days: float = ARCHIVE_AFTER_DAYS) -> ArchiveReport:
+    """
+    Moves ledger rows created more than max_age_days ago, and their spins, into the per-month
+    archive files, ARCHIVE_BATCH ledger rows per transaction. Reconciles first and refuses to
+    archive anything if the ledger disagrees with a balance.
+    """
+    global last_archive
+    report = await reconcile()
+    if report.mismatches:
+        raise RuntimeError(f"{len(report.mismatches)} balances disagree with the ledger; not archiving until that is fixed")
+    async with _archive_lock:
+        started = time.perf_counter()
+        # created_at is CURRENT_TIMESTAMP, i.e. UTC
+        cutoff = (datetime.now(timezone.utc) - timedelta(days=max_age_days)).strftime("%Y-%m-%d %H:%M:%S")
+        months, ledger_total, spin_total, users = [], 0, 0, set()
+        await asyncio.to_thread(os.makedirs, ARCHIVE_DIR, exist_ok=True)
+        async with db_pool.acquire() as db:
+            checkpointed = (await db.execute_fetchall("SELECT last_ledger_id FROM reconcile_state WHERE id = 1"))[0][0]
+            newest_old = (await db.execute_fetchall("SELECT COALESCE(MAX(id), 0) FROM ledger WHERE created_at < ?", (cutoff,)))[0][0]
+            through = min(checkpointed, newest_old)
+            cursor = 0
+            while True:
+                ids = await db.execute_fetchall(
+                    "SELECT id, substr(created_at, 1, 7) FROM ledger WHERE id > ? AND id <= ? ORDER BY id LIMIT ?",
+                    (cursor, through, ARCHIVE_BATCH))
+                if not ids:
+                    break
+                # one month per transaction, so each batch goes to a single archive file
+                month = ids[0][1]
+                lo = hi = ids[0][0]
+                for row_id, row_month in ids:
+                    if row_month != month:
+                        break
+                    hi = row_id
+                path = os.path.join(ARCHIVE_DIR, f"casino-{month}.db")
+                async with attach_archive(db, path, readonly=False) as schema:
+                    for statement in ARCHIVE_SCHEMA:
+                        await db.execute(statement.format(schema=schema))
+                    ledger_rows, spin_rows, carried = await _archive_range(db, schema, month, path, lo, hi)
+                ledger_total += ledger_rows
+                spin_total += spin_rows
+                users |= carried
+                if month not in months:
+                    months.append(month)
+                cursor = hi
+        last_archive = ArchiveReport(months, ledger_total, spin_total, len(users), through if months else 0,
+                                     time.perf_counter() - started)
+        return last_archive
+
+@tasks.loop(seconds=ARCHIVE_INTERVAL or 86400)
+async def archive_loop():
+    try:
+        report = await archive_old_rows()
+        if report.ledger_rows:
+            print(f"Archived {report.ledger_rows} ledger rows and {report.spin_rows} spins into {', '.join(report.months)}")
+    except Exception as e:
+        print("Background archiving failed:", e)
+
+@archive_loop.before_loop
+async def _archive_loop_wait():
+    # first run one interval after startup, not the moment the bot boots
+    await asyncio.sleep(ARCHIVE_INTERVAL)
+
+# -------------------------
+# Backups
+# -------------------------
+# Snapshots of casino.db are taken while the bot runs with SQLite's online backup API, on a
+# worker thread with its own connection, BACKUP_STEP_PAGES pages at a time with a short sleep
+# between steps. The source connection holds one read transaction for the whole copy: in WAL
+# mode that pins a consistent snapshot without blocking writers, and stops commits made
+# meanwhile from restarting the backup. Each copy is checked with PRAGMA integrity_check,
+# gzipped into BACKUP_DIR and the oldest snapshots beyond BACKUP_KEEP are deleted.
+# Archive files are copied the same way into BACKUP_DIR/archive as casino-YYYY-MM-<archived_at>.db.gz,
+# but only when their archived_at has changed since the copy already there. The whole backup
+# holds the archive lock, so the snapshot's archives table matches the archive copies taken
+# with it. Rotation keeps, per month, the newest copy and the one each kept snapshot needs.
+class BackupReport(NamedTuple):
+    path: str           # the .db.gz snapshot
+    pages: int
+    db_bytes: int       # size of the uncompressed copy
+    gz_bytes: int
+    removed: int        # old snapshots and archive copies deleted by rotation
+    seconds: float
+    archives: list      # YYYY-MM archive files copied because they changed
+
+_backup_lock = asyncio.Lock()
+last_backup: Optional[BackupReport] = None
+
+def _copy_database(src_path: str, dst_path: str) -> int:
+    """Copies src_path to dst_path page by page and checks the copy. Returns its page count."""
+    src = sqlite3.connect(src_path, timeout=DB_BUSY_TIMEOUT_MS / 1000, isolation_level=None)
+    dst = sqlite3.connect(dst_path)
+    try:
+        src.execute("BEGIN")
+        src.execute("SELECT COUNT(*) FROM sqlite_master").fetchall()
+        src.backup(dst, pages=BACKUP_STEP_PAGES,
+                   progress=lambda status, remaining, total: time.sleep(BACKUP_STEP_SLEEP_MS / 1000))
+        src.execute("COMMIT")
+        problems = [r[0] for r in dst.execute("PRAGMA integrity_check")]
+        if problems != ["ok"]:
+            raise RuntimeError("backup failed integrity_check: " + "; ".join(problems[:5]))
+        return dst.execute("PRAGMA page_count").fetchone()[0]
+    finally:
+        src.close()
+        dst.close()
+
+def _compress_file(src_path: str, dst_path: str):
+    with open(src_path, "rb") as src, gzip.open(dst_path, "wb", compresslevel=6) as dst:
+        shutil.copyfileobj(src, dst, 1 << 20)
+
+def _rotate_backups(directory: str, keep: int) -> int:
+    """Deletes all but the newest `keep` snapshots. Returns how many were deleted."""
+    names = sorted(n for n in os.listdir(directory) if n.startswith("casino-") and n.endswith(".db.gz"))
+    old = names[:-keep] if keep > 0 else []
+    for name in old:
+        os.remove(os.path.join(directory, name))
+    return len(old)
+
+def _rotate_archive_backups(directory: str, snapshot_dir: str) -> int:
+    """
+    Deletes archive copies no snapshot in snapshot_dir needs. For each month the newest copy is
+    kept, plus the newest one at or before each snapshot's stamp. Returns how many were deleted.
+    """
+    # casino-YYYYmmdd-HHMMSS.db.gz and casino-YYYY-MM-YYYYmmdd-HHMMSS.db.gz
+    snapshots = [n[7:-6] for n in os.listdir(snapshot_dir) if n.startswith("casino-") and n.endswith(".db.gz")]
+    copies = defaultdict(list)
+    for name in sorted(n for n in os.listdir(directory) if n.startswith("casino-") and n.endswith(".db.gz")):
+        copies[name[7:14]].append((name[15:-6], name))
+    removed = 0
+    for entries in copies.values():
+        needed = {entries[-1][1]}
+        for snapshot in snapshots:
+            older = [name for stamp, name in entries if stamp <= snapshot]
+            if older:
+                needed.add(older[-1])
+        for _, name in entries:
+            if name not in needed:
+                os.remove(os.path.join(directory, name))
+                removed += 1
+    return removed
+
+async def _write_snapshot(src_path: str, path: str) -> tuple:
+    """Copies src_path to the gzipped snapshot path, via a hidden temp copy. Returns (pages, uncompressed bytes)."""
+    tmp = os.path.join(os.path.dirname(path), "." + os.path.basename(path)[:-len(".gz")])
+    try:
+        pages = await asyncio.to_thread(_copy_database, src_path, tmp)
+        db_bytes = os.path.getsize(tmp)
+        await asyncio.to_thread(_compress_file, tmp, path + ".part")
+        # the rename makes a snapshot visible only once it is complete
+        os.replace(path + ".part", path)
+    finally:
+        for leftover in (tmp, path + ".part"):
+            if os.path.exists(leftover):
+                os.remove(leftover)
+    return pages, db_bytes
+
+async def _backup_archives(directory: str) -> list:
+    """Copies the archive files whose archived_at has no copy in directory yet. Returns their months."""
+    async with db_pool.acquire() as db:
+        catalog = await archive_catalog(db)
+    copied = []
+    for month, src_path, _, _, archived_at in catalog:
+        stamp = datetime.strptime(archived_at, "%Y-%m-%d %H:%M:%S").strftime("%Y%m%d-%H%M%S")
+        path = os.path.join(directory, f"casino-{month}-{stamp}.db.gz")
+        if os.path.exists(path):
+            continue
+        # sqlite3.connect would quietly create an empty file in its place
+        if not os.path.exists(src_path):
+            raise RuntimeError(f"archive file {src_path} for {month} is missing")
+        await _write_snapshot(src_path, path)
+        copied.append(month)
+    return copied
+
+@writer_op(BackupReport)
+async def backup_database() -> BackupReport:
+    """
+    Writes a verified, compressed snapshot of casino.db to BACKUP_DIR, with copies of the archive
+    files that changed since the last backup, and rotates old ones.
+    """
+    global last_backup
+    async with _backup_lock, _archive_lock:
+        started = time.perf_counter()
+        archive_dir = os.path.join(BACKUP_DIR, "archive")
+        await asyncio.to_thread(os.makedirs, archive_dir, exist_ok=True)
+        # archives first, so every visible snapshot already has the archive copies it refers to
+        archives = await _backup_archives(archive_dir)
+        stamp = datetime.now(timezone.utc).strftime("%Y%m%d-%H%M%S")
+        path = os.path.join(BACKUP_DIR, f"casino-{stamp}.db.gz")
+        pages, db_bytes = await _write_snapshot(DB_FILE, path)
+        removed = await asyncio.to_thread(_rotate_backups, BACKUP_DIR, BACKUP_KEEP)
+        removed += await asyncio.to_thread(_rotate_archive_backups, archive_dir, BACKUP_DIR)
+        seconds = time.perf_counter() - started
+        metrics.observe("casino_backup_seconds", seconds)
+        last_backup = BackupReport(path, pages, db_bytes, os.path.getsize(path), removed, seconds, archives)
+        return last_backup
+
+@writer_op(BackupReport)
+async def get_last_backup() -> Optional[BackupReport]:
+    return last_backup
+
+@tasks.loop(seconds=BACKUP_INTERVAL or 21600)
+async def backup_loop():
+    try:
+        report = await backup_database()
+        print(f"Backed up {DB_FILE} to {report.path} ({report.db_bytes:,} bytes, {report.gz_bytes:,} compressed) "
+              f"in {report.seconds:.1f}s" + (f"; archives {', '.join(report.archives)}" if report.archives else ""))
+    except Exception as e:
+        print("Background backup failed:", e)
+
+# -------------------------
+# Bulk admin operations
+# -------------------------
+# Bulk commands validate every row first and then apply all of them in one transaction with
+# executemany; if anything is wrong nothing is written and the problems are reported instead.
+
+# action -> (statuses it applies to, new status, ledger type, ledger sign)
+# a selector like "all" / "under:N" picks rows in the first listed status
+BULK_CASHOUT_ACTIONS = {
+    "approve": (("queued",), "approved", "payout_approved", -1),
+    "markpaid": (("approved", "queued"), "paid", "payout_sent", -1),
+    "reject": (("queued",), "rejected", "payout_rejected_refund", 1),
+}
+
+def parse_id_selector(text: str) -> tuple:
+    """
+    Parses "12-40,45,51", "all" or "under:500" (amount below 500 coins).
+    Returns (ids, max_coins, error); ids is None when the selector is a filter.
+    """
+    text = text.replace(" ", "").lower()
+    if text == "all":
+        return None, None, None
+    if text.startswith("under:"):
+        value = text[len("under:"):]
+        if not value.isdigit():
+            return None, None, f"Bad amount in `{text}`; use e.g. `under:500`."
+        return None, int(value), None
+    ids = []
+    for part in filter(None, text.split(",")):
+        low, _, high = part.partition("-")
+        if not low.isdigit() or (high and not high.isdigit()):
+            return None, None, f"Bad id or range `{part}`; use e.g. `12-40,45,51`."
+        low, high = int(low), int(high or low)
+        if high < low or len(ids) + high - low + 1 > BULK_MAX_ROWS:
+            return None, None, f"Range `{part}` is backwards or selects more than {BULK_MAX_ROWS} ids."
+        ids.extend(range(low, high + 1))
+    if not ids:
+        return None, None, "No ids given."
+    return sorted(set(ids)), None, None
+
+def format_id_ranges(ids: list) -> str:
+    """[1, 2, 3, 7, 9, 10] -> "1-3,7,9-10"."""
+    parts = []
+    for _, group in itertools.groupby(enumerate(sorted(ids)), key=lambda p: p[1] - p[0]):
+        run = [i for _, i in group]
+        parts.append(str(run[0]) if len(run) == 1 else f"{run[0]}-{run[-1]}")
+    return ",".join(parts)
+
+async def _select_cashouts(db, ids: Optional[list], max_coins: Optional[int], status: str) -> list:
+    columns = "id,discord_id,paypal_email,amount_coins,status"
+    if ids is not None:
+        sql, params = f"SELECT {columns} FROM cashouts WHERE id IN (SELECT value FROM json_each(?)) ORDER BY id", (json.dumps(ids),)
+    elif max_coins is not None:
+        sql, params = f"SELECT {columns} FROM cashouts WHERE status = ? AND amount_coins < ? ORDER BY id LIMIT ?", (status, max_coins, BULK_MAX_ROWS + 1)
+    else:
+        sql, params = f"SELECT {columns} FROM cashouts WHERE status = ? ORDER BY id LIMIT ?", (status, BULK_MAX_ROWS + 1)
+    # "all" / "under:N" read one row past the cap, so the caller can tell it left some behind
+    return await db.execute_fetchall(sql, params)
+
+async def _lock_users(stack: AsyncExitStack, discord_ids):
+    # always in id order, so two bulk commands cannot deadlock on each other's users
+    for discord_id in sorted(set(discord_ids)):
+        await stack.enter_async_context(balance_cache.lock(discord_id))
+
+async def _cached_balances(db, discord_ids) -> list:
+    return await db.execute_fetchall(
+        "SELECT discord_id,balance FROM users WHERE discord_id IN (SELECT value FROM json_each(?))",
+        (json.dumps(sorted(set(discord_ids))),))
+
+@writer_op()
+async def bulk_cashout_action(action: str, ids: Optional[list], max_coins: Optional[int],
+                              admin_id: int, reason: str = "") -> tuple:
+    """
+    Approves, marks paid or rejects (with refund) many cashouts in one transaction.
+    Returns (rows, problems, more): the (id, discord_id, paypal_email, amount_coins, status) rows
+    changed, or an empty list and the reasons nothing was changed; more is True when "all" /
+    "under:N" matched more than BULK_MAX_ROWS requests and only the first BULK_MAX_ROWS were handled.
+    """
+    from_statuses, to_status, ltype, sign = BULK_CASHOUT_ACTIONS[action]
+    more = False
+    # find the rows first: a reject refunds balances, so those users are locked before writing
+    async with db_pool.acquire() as db:
+        rows = await _select_cashouts(db, ids, max_coins, from_statuses[0])
+    if ids is None:
+        more = len(rows) > BULK_MAX_ROWS
+        rows = rows[:BULK_MAX_ROWS]
+        ids = [r[0] for r in rows]
+    if not ids:
+        return [], [], False
+    async with AsyncExitStack() as stack:
+        if sign > 0:
+            await _lock_users(stack, (r[1] for r in rows))
+        async with db_pool.acquire() as db:
+            await db.execute("BEGIN IMMEDIATE")
+            # re-read under the write lock; another admin may have handled some of them meanwhile
+            rows = await _select_cashouts(db, ids, None, from_statuses[0])
+            found = {r[0] for r in rows}
+            problems = [f"#{i} not found" for i in ids if i not in found]
+            problems += [f"#{r[0]} is {r[4]}" for r in rows if r[4] not in from_statuses]
+            if problems:
+                await db.rollback()
+                return [], problems, False
+            await db.executemany("UPDATE cashouts SET status = ? WHERE id = ?", [(to_status, r[0]) for r in rows])
+            # same typed columns as the single-row commands
+            if action == "approve":
+                extra = [(None, admin_id, r[2]) for r in rows]
+            elif action == "markpaid":
+                extra = [(None, admin_id, None) for r in rows]
+            else:
+                extra = [(f"reason:{reason}", None, None) for r in rows]
+            await db.executemany("INSERT INTO ledger (discord_id,type,amount,status,request_id,metadata,admin_id,paypal) "
+                                 "VALUES (?,?,?,?,?,?,?,?)",
+                                 [(r[1], ltype, sign * r[3], "completed", r[0], *e) for r, e in zip(rows, extra)])
+            balances = []
+            if action == "markpaid":
+                await db.executemany(UPSERT_CASHOUT_STATS, [(r[1], r[3]) for r in rows])
+            elif action == "reject":
+                await db.executemany("UPDATE users SET balance = balance + ? WHERE discord_id = ?", [(r[3], r[1]) for r in rows])
+                balances = await _cached_balances(db, (r[1] for r in rows))
+            await db.commit()
+        for discord_id, balance in balances:
+            balance_cache.put(discord_id, balance)
+    return rows, [], more
+
+def parse_credit_csv(text: str) -> tuple:
+    """
+    Parses a credit sheet: discord_id,coins[,note] per line, or a header row naming the
+    columns discord_id and coins or pence (plus an optional note).
+    Returns ([(discord_id, coins, note)], problems).
+    """
+    lines = [(number, line) for number, line in enumerate(csv.reader(text.splitlines()), start=1)
+             if any(cell.strip() for cell in line)]
+    if not lines:
+        return [], ["The file is empty."]
+    header = [cell.strip().lower() for cell in lines[0][1]]
+    id_col, amount_col, note_col, scale = 0, 1, 2, 1
+    if not header[0].strip("<@!>").isdigit():
+        lines = lines[1:]
+        id_col = next((header.index(name) for name in ("discord_id", "user", "id") if name in header), None)
+        amount_col = next((header.index(name) for name in ("coins", "pence") if name in header), None)
+        note_col = header.index("note") if "note" in header else None
+        if id_col is None or amount_col is None:
+            return [], ["The header needs a discord_id column and a coins or pence column."]
+        scale = PENCE_TO_COINS if header[amount_col] == "pence" else 1
+    if len(lines) > BULK_MAX_ROWS:
+        return [], [f"{len(lines)} rows is more than the {BULK_MAX_ROWS} allowed per import."]
+    rows, problems = [], []
+    for number, line in lines:
+        cells = [cell.strip() for cell in line]
+        user = cells[id_col].strip("<@!>") if id_col < len(cells) else ""
+        amount = cells[amount_col] if amount_col < len(cells) else ""
+        note = cells[note_col] if note_col is not None and note_col < len(cells) else ""
+        if not user.isdigit():
+            problems.append(f"line {number}: bad discord id `{user}`")
+        elif not amount.lstrip("-").isdigit() or int(amount) == 0 or (scale != 1 and int(amount) < 0):
+            problems.append(f"line {number}: bad amount `{amount}`")
+        else:
+            rows.append((int(user), int(amount) * scale, note.replace(";", ",")))
+    return rows, problems
+
+@writer_op()
+async def bulk_credit(rows: list, admin_id: int, source: str) -> tuple:
+    """
+    Applies [(discord_id, coins, note)] as admin_credit ledger rows and balance changes in one
+    transaction. Returns (balances, problems); nothing is written if any balance would go negative.
+    """
+    async with AsyncExitStack() as stack:
+        await _lock_users(stack, (r[0] for r in rows))
+        async with db_pool.acquire() as db:
+            await db.execute("BEGIN IMMEDIATE")
+            await db.executemany("INSERT OR IGNORE INTO users (discord_id,balance) VALUES (?, 0)", {(r[0],) for r in rows})
+            await db.executemany("UPDATE users SET balance = balance + ? WHERE discord_id = ?", [(r[1], r[0]) for r in rows])
+            await db.executemany("INSERT INTO ledger (discord_id,type,amount,status,admin_id,metadata) VALUES (?,?,?,?,?,?)",
+                                 [(r[0], "admin_credit", r[1], "completed", admin_id,
+                                   f"import:{source}" + (f";note:{r[2]}" if r[2] else "")) for r in rows])
+            balances = await _cached_balances(db, (r[0] for r in rows))
+            negative = [f"<@{discord_id}> would end at {balance} coins" for discord_id, balance in balances if balance < 0]
+            if negative:
+                await db.rollback()
+                return [], negative
+            await db.commit()
+        for discord_id, balance in balances:
+            balance_cache.put(discord_id, balance)
+    return balances, []
+
+# -------------------------
+# Player stats / leaderboard
+# -------------------------
+class Leaderboard:
+    """Top players by net result, re-read from user_stats at most once per ttl seconds."""
+
+    def __init__(self, size: int, ttl: float):
+        self.size = size
+        self.ttl = ttl
+        self._rows = []
+        self._expires = 0.0
+        self._lock = asyncio.Lock()
+
+    async def top(self) -> list:
+        """Returns [(discord_id, net, spins)], best first."""
+        async with self._lock:
+            if time.monotonic() >= self._expires:
+                async with db_pool.acquire() as db:
+                    self._rows = await db.execute_fetchall(HOT_QUERIES["leaderboard"][0], (self.size,))
+                self._expires = time.monotonic() + self.ttl
+            return self._rows
+
+    def invalidate(self):
+        self._expires = 0.0
+
+leaderboard = Leaderboard(LEADERBOARD_SIZE, LEADERBOARD_TTL)
+
+@writer_op()
+async def rebuild_user_stats() -> int:
+    """Recomputes user_stats from the whole history, archive files included. Returns the user count."""
+    # hold off archiving, which would move rows between the archive and casino.db reads
+    async with _archive_lock:
+        async with db_pool.acquire() as db:
+            await db.execute("CREATE TEMP TABLE IF NOT EXISTS archived_stats "
+                             "(discord_id INTEGER, spins INTEGER, wagered INTEGER, won INTEGER, biggest INTEGER, cashed INTEGER)")
+            try:
+                for _, path, *_ in await archive_catalog(db):
+                    async with attach_archive(db, path) as schema:
+                        await db.execute(f"INSERT INTO temp.archived_stats {_stats_history_sql(schema)}")
+                        await db.commit()
+                await db.execute("BEGIN IMMEDIATE")
+                await backfill_user_stats(db, archived=True)
+                users = (await db.execute_fetchall("SELECT COUNT(*) FROM user_stats"))[0][0]
+                await db.commit()
+            finally:
+                if db.in_transaction:
+                    await db.rollback()
+                await db.execute("DROP TABLE IF EXISTS temp.archived_stats")
+    leaderboard.invalidate()
+    return users
+
+# -------------------------
+# Cashout queue
+# -------------------------
+class CashoutQueue:
+    """
+    Queued cashouts held in memory, oldest first, so !list_requests pages never rescan the
+    cashouts table, plus each user's recent requests for !status. Loaded on first use; the
+    cashout / approve / markpaid / reject commands call add() and remove() to keep it current.
+    ttl=None trusts it indefinitely (every change goes through this process); a shard process
+    sets a ttl because other shards change the queue too.
+    """
+
+    def __init__(self, ttl: Optional[float], status_size: int = 1000):
+        self.ttl = ttl
+        self.status_size = status_size
+        self._rows = {}             # id -> (id, discord_id, paypal_email, amount_coins, created_at)
+        self._ids = []              # sorted ids, for keyset paging
+        self._by_user = defaultdict(list)
+        self._expires = None        # None = not loaded yet
+        self._pending = None        # changes made while a load is in flight, replayed after it
+        self._status = OrderedDict()  # discord_id -> (expires, rows), LRU
+        self._status_reads = {}       # discord_id -> [status reads in flight, changes seen], only while one is
+        self._lock = asyncio.Lock()
+
+    async def _ensure_loaded(self):
+        async with self._lock:
+            if self._expires is not None and (self.ttl is None or time.monotonic() < self._expires):
+                return
+            self._pending = []
+            try:
+                async with db_pool.acquire() as db:
+                    rows = await db.execute_fetchall(HOT_QUERIES["list_requests"][0])
+                self._rows = {r[0]: (r[0], r[1], r[2], r[3], r[5]) for r in rows}
+                self._ids = sorted(self._rows)
+                self._by_user = defaultdict(list)
+                for row_id in self._ids:
+                    self._by_user[self._rows[row_id][1]].append(row_id)
+                for change, arg in self._pending:
+                    change(arg)
+                self._expires = time.monotonic() + (self.ttl or 0)
+                self._status.clear()
+            finally:
+                self._pending = None
+
+    def add(self, row: tuple):
+        """Indexes a new queued request: (id, discord_id, paypal_email, amount_coins, created_at)."""
+        self._forget_status(row[1])
+        if self._pending is not None:
+            self._pending.append((self._add, row))
+        elif self._expires is not None:
+            self._add(row)
+
+    def remove(self, request_id: int, discord_id: int):
+        """Drops a request that is no longer queued (approved, paid or rejected)."""
+        self._forget_status(discord_id)
+        if self._pending is not None:
+            self._pending.append((self._remove, request_id))
+        elif self._expires is not None:
+            self._remove(request_id)
+
+    def _forget_status(self, discord_id: int):
+        self._status.pop(discord_id, None)
+        reads = self._status_reads.get(discord_id)
+        if reads:
+            reads[1] += 1
+
+    def _add(self, row: tuple):
+        if row[0] in self._rows:
+            return
+        self._rows[row[0]] = row
+        bisect.insort(self._ids, row[0])
+        bisect.insort(self._by_user[row[1]], row[0])
+
+    def _remove(self, request_id: int):
+        row = self._rows.pop(request_id, None)
+        if row is None:
+            return
+        del self._ids[bisect.bisect_left(self._ids, request_id)]
+        user_ids = self._by_user[row[1]]
+        del user_ids[bisect.bisect_left(user_ids, request_id)]
+        if not user_ids:
+            del self._by_user[row[1]]
+
+    async def page(self, after: Optional[int] = None, before: Optional[int] = None, limit: int = CASHOUT_PAGE_SIZE,
+                   user: Optional[int] = None, min_coins: Optional[int] = None, max_coins: Optional[int] = None) -> tuple:
+        """
+        One keyset page, oldest first: the requests after id `after`, or the last `limit` before
+        id `before`. Returns (rows, matching requests, matching coins, more before, more after).
+        """
+        await self._ensure_loaded()
+        ids = self._ids if user is None else self._by_user.get(user, [])
+
+        def matches(row_id):
+            coins = self._rows[row_id][3]
+            return (min_coins is None or coins >= min_coins) and (max_coins is None or coins <= max_coins)
+
+        if min_coins is None and max_coins is None:
+            matching = ids
+        else:
+            matching = [row_id for row_id in ids if matches(row_id)]
+        if before is not None:
+            end = bisect.bisect_left(matching, before)
+            start = max(0, end - limit)
+        else:
+            start = bisect.bisect_right(matching, after or 0)
+            end = start + limit
+        rows = [self._rows[row_id] for row_id in matching[start:end]]
+        total = sum(self._rows[row_id][3] for row_id in matching)
+        return rows, len(matching), total, start > 0, end < len(matching)
+
+    async def user_requests(self, discord_id: int) -> list:
+        """The user's 10 newest requests of any status, as !status shows them."""
+        entry = self._status.get(discord_id)
+        if entry and (entry[0] is None or time.monotonic() < entry[0]):
+            self._status.move_to_end(discord_id)
+            return entry[1]
+        reads = self._status_reads.setdefault(discord_id, [0, 0])
+        reads[0] += 1
+        changes = reads[1]
+        try:
+            async with db_pool.acquire() as db:
+                rows = await db.execute_fetchall(HOT_QUERIES["status"][0], (discord_id,))
+        finally:
+            reads[0] -= 1
+            if not reads[0]:
+                del self._status_reads[discord_id]
+        # a change that landed during the read may be missing from these rows: return them, don't cache them
+        if reads[1] == changes:
+            self._status[discord_id] = (None if self.ttl is None else time.monotonic() + self.ttl, rows)
+            if len(self._status) > self.status_size:
+                self._status.popitem(last=False)
+        return rows
+
+cashout_queue = CashoutQueue(CASHOUT_QUEUE_TTL if ROLE == "shard" else None)
+
+# !list_requests amount filter choices: label -> (min_coins, max_coins)
+QUEUE_AMOUNT_FILTERS = {
+    "Any amount": (None, None),
+    "Under 500 coins": (None, 499),
+    "500 – 4,999 coins": (500, 4999),
+    "5,000 coins or more": (5000, None),
+}
+
+class CashoutQueueView(discord.ui.View):
+    """Prev / next / refresh buttons and amount / user filters under a !list_requests page."""
+
+    def __init__(self, user: Optional[int] = None, min_coins: Optional[int] = None, max_coins: Optional[int] = None):
+        super().__init__(timeout=600)
+        self.user = user
+        self.min_coins = min_coins
+        self.max_coins = max_coins
+        self.first_id = self.last_id = None
+        self.message = None
+
+    async def render(self, after: Optional[int] = None, before: Optional[int] = None) -> str:
+        rows, count, total, more_before, more_after = await cashout_queue.page(
+            after, before, CASHOUT_PAGE_SIZE, self.user, self.min_coins, self.max_coins)
+        if not rows and (after or before):
+            # the page emptied meanwhile (requests handled); fall back to the first page
+            rows, count, total, more_before, more_after = await cashout_queue.page(
+                None, None, CASHOUT_PAGE_SIZE, self.user, self.min_coins, self.max_coins)
+        self.first_id = rows[0][0] if rows else None
+        self.last_id = rows[-1][0] if rows else None
+        self.prev_page.disabled = not more_before
+        self.next_page.disabled = not more_after
+        filters = [f"user <@{self.user}>"] if self.user else []
+        if self.min_coins is not None and self.max_coins is not None:
+            filters.append(f"{self.min_coins:,}–{self.max_coins:,} coins")
+        elif self.min_coins is not None:
+            filters.append(f"≥ {self.min_coins:,} coins")
+        elif self.max_coins is not None:
+            filters.append(f"≤ {self.max_coins:,} coins")
+        title = f"Queued cashout requests{' (' + ', '.join(filters) + ')' if filters else ''}: {count:,} — {total:,} coins ({coins_to_pounds(total)})"
+        if not rows:
+            return title + "\nNothing matches."
+        lines = [title, "ID — user — email — coins — created:"]
+        for r in rows:
+            email = r[2] if len(r[2]) <= 64 else r[2][:63] + "…"
+            lines.append(f"{r[0]} — <@{r[1]}> — {email} — {r[3]} coins — {r[4]}")
+        return "\n".join(lines)[:2000]
+
+    async def interaction_check(self, interaction: discord.Interaction) -> bool:
+        if is_admin_user(interaction.user):
+            return True
+        await interaction.response.send_message("Only admins can page the cashout queue.", ephemeral=True)
+        return False
+
+    async def _show(self, interaction: discord.Interaction, after: Optional[int] = None, before: Optional[int] = None):
+        content = await self.render(after, before)
+        await interaction.response.edit_message(content=content, view=self, allowed_mentions=discord.AllowedMentions.none())
+
+    @discord.ui.button(label="◀ Prev", style=discord.ButtonStyle.secondary, row=0)
+    async def prev_page(self, interaction: discord.Interaction, button: discord.ui.Button):
+        await self._show(interaction, before=self.first_id)
+
+    @discord.ui.button(label="Next ▶", style=discord.ButtonStyle.secondary, row=0)
+    async def next_page(self, interaction: discord.Interaction, button: discord.ui.Button):
+        await self._show(interaction, after=self.last_id)
+
+    @discord.ui.button(label="Refresh", style=discord.ButtonStyle.primary, row=0)
+    async def refresh(self, interaction: discord.Interaction, button: discord.ui.Button):
+        await self._show(interaction, after=self.first_id - 1 if self.first_id else None)
+
+    @discord.ui.select(placeholder="Filter by amount", row=1,
+                       options=[discord.SelectOption(label=label) for label in QUEUE_AMOUNT_FILTERS])
+    async def amount_filter(self, interaction: discord.Interaction, select: discord.ui.Select):
+        self.min_coins, self.max_coins = QUEUE_AMOUNT_FILTERS[select.values[0]]
+        await self._show(interaction)
+
+    @discord.ui.select(cls=discord.ui.UserSelect, placeholder="Filter by user (clear for everyone)", min_values=0, row=2)
+    async def user_filter(self, interaction: discord.Interaction, select: discord.ui.UserSelect):
+        self.user = select.values[0].id if select.values else None
+        await self._show(interaction)
+
+    async def on_timeout(self):
+        if self.message is not None:
+            for item in self.children:
+                item.disabled = True
+            try:
+                await self.message.edit(view=self)
+            except discord.HTTPException:
+                pass
 
 # -------------------------
 # Utility
@@ -177,40 +2710,11 @@ async def cmd_balance(ctx):
 
 @bot.command(name="spin")
 async def cmd_spin(ctx):
-    await ensure_user(ctx.author.id)
-    bal = await get_balance(ctx.author.id)
-    if bal < SPIN_COST:
+    result = await play_spin(ctx.author.id)
+    if result is None:
         return await ctx.send(f"❌ Not enough coins to spin. You need {SPIN_COST} coins. Use `!topup` and ask an admin to credit you.")
-    # Deduct cost and record bet
-    # create ledger for bet
-    ledger_id_bet = await add_ledger_only(ctx.author.id, -SPIN_COST, "bet", "spin_cost")
-    # update balance
-    async with aiosqlite.connect(DB_FILE) as db:
-        await db.execute("UPDATE users SET balance = balance - ? WHERE discord_id = ?", (SPIN_COST, ctx.author.id))
-        await db.commit()
-
-    # spin reels
-    s1 = random.choice(SYMBOLS)
-    s2 = random.choice(SYMBOLS)
-    s3 = random.choice(SYMBOLS)
-    combo = (s1, s2, s3)
-    won = PRIZES.get(combo, 0)
-
-    win_ledger_id = None
-    if won > 0:
-        # credit winnings and ledger
-        win_ledger_id = await change_balance_with_ledger(ctx.author.id, won, "win", f"symbols:{s1},{s2},{s3}")
-    else:
-        # create a spin_result ledger row for audit (0 win)
-        win_ledger_id = await add_ledger_only(ctx.author.id, 0, "spin_result", f"symbols:{s1},{s2},{s3}")
-
-    # log the spin
-    async with aiosqlite.connect(DB_FILE) as db:
-        await db.execute("INSERT INTO spins (discord_id,s1,s2,s3,won,ledger_id) VALUES (?,?,?,?,?,?)",
-                         (ctx.author.id, s1, s2, s3, won, win_ledger_id))
-        await db.commit()
-
-    new_bal = await get_balance(ctx.author.id)
+    s1, s2, s3 = result.symbols
+    won, win_ledger_id, new_bal = result.won, result.ledger_id, result.balance
     lines = [f"🎰 **SPIN RESULT** — {ctx.author.mention}", f"[{s1}] [{s2}] [{s3}]"]
     if won > 0:
         lines.append(f"🎉 You won **{won} coins** ({coins_to_pounds(won)}) — ledger id: {win_ledger_id}")
@@ -221,14 +2725,71 @@ async def cmd_spin(ctx):
     await ctx.send("\n".join(lines))
 
     # announce publicly (if configured)
-    if ANNOUNCE_CHANNEL_ID:
-        try:
-            ch = bot.get_channel(ANNOUNCE_CHANNEL_ID) or await bot.fetch_channel(ANNOUNCE_CHANNEL_ID)
-            if ch:
-                if won > 0:
-                    await ch.send(f"🎉 WIN: <@{ctx.author.id}> won **{won} coins** ({coins_to_pounds(won)}) — symbols: {s1} {s2} {s3} — ledger {win_ledger_id}")
-        except Exception:
-            pass
+    if won > 0:
+        win_announcer.announce(f"🎉 WIN: <@{ctx.author.id}> won **{won} coins** ({coins_to_pounds(won)}) — symbols: {s1} {s2} {s3} — ledger {win_ledger_id}", won)
+
+@bot.command(name="multispin", aliases=["autospin"])
+async def cmd_multispin(ctx, count: int):
+    """
+    Spin many times in one go and get a single summary.
+    Usage: !multispin 100   (spins up to 100 times, stopping early if your balance runs out)
+    """
+    if count <= 0 or count > MULTISPIN_MAX:
+        return await ctx.send(f"Enter a number of spins between 1 and {MULTISPIN_MAX}.")
+    result = await play_multispin(ctx.author.id, count)
+    if result is None:
+        return await ctx.send(f"❌ Not enough coins to spin. You need {SPIN_COST} coins. Use `!topup` and ask an admin to credit you.")
+    spins = len(result.outcomes)
+    bet = spins * SPIN_COST
+    net = result.total_won - bet
+    wins = Counter(o for o in result.outcomes if PAYOUTS[o])
+    lines = [f"🎰 **MULTISPIN RESULT** — {ctx.author.mention}",
+             f"Spins: **{spins}**" + (f" (balance covered {spins} of {count})" if spins < count else "") + f" — bet **{bet} coins**"]
+    if wins:
+        lines.append(f"🎉 {sum(wins.values())} winning spins — total won **{result.total_won} coins** ({coins_to_pounds(result.total_won)}) — ledger id: {result.ledger_id}")
+        for outcome, n in sorted(wins.items(), key=lambda kv: -PAYOUTS[kv[0]]):
+            s1, s2, s3 = OUTCOME_SYMBOLS[outcome]
+            lines.append(f"  [{s1}] [{s2}] [{s3}] ×{n} → {PAYOUTS[outcome] * n} coins")
+    else:
+        lines.append("😢 No wins this run.")
+    lines.append(f"📊 Net: **{net:+d} coins**")
+    lines.append(f"💰 New balance: **{result.balance} coins** ({coins_to_pounds(result.balance)})")
+
+    await ctx.send("\n".join(lines))
+
+    # announce publicly (if configured)
+    if result.total_won > 0:
+        win_announcer.announce(f"🎉 WIN: <@{ctx.author.id}> won **{result.total_won} coins** ({coins_to_pounds(result.total_won)}) over {spins} spins — ledger {result.ledger_id}", result.total_won)
+
+@bot.command(name="stats")
+async def cmd_stats(ctx, member: Optional[discord.Member] = None):
+    target = member or ctx.author
+    async with db_pool.acquire() as db:
+        rows = await db.execute_fetchall(HOT_QUERIES["stats"][0], (target.id,))
+    if not rows:
+        return await ctx.send(f"No stats yet for {target.display_name}.")
+    spins, wagered, won, biggest, cashed = rows[0]
+    net = won - wagered
+    lines = [
+        f"📊 **Stats for {target.display_name}**",
+        f"Spins: {spins:,}",
+        f"Wagered: {wagered:,} coins ({coins_to_pounds(wagered)})",
+        f"Won: {won:,} coins ({coins_to_pounds(won)})",
+        f"Biggest win: {biggest:,} coins",
+        f"Net: {'+' if net >= 0 else '-'}{abs(net):,} coins ({'+' if net >= 0 else '-'}{coins_to_pounds(abs(net))})",
+        f"Cashed out: {cashed:,} coins ({coins_to_pounds(cashed)})",
+    ]
+    await ctx.send("\n".join(lines))
+
+@bot.command(name="leaderboard", aliases=["top"])
+async def cmd_leaderboard(ctx):
+    rows = await leaderboard.top()
+    if not rows:
+        return await ctx.send("Nobody has spun yet.")
+    lines = [f"🏆 **Leaderboard** — top {len(rows)} by net coins (updated every {leaderboard.ttl:.0f}s)"]
+    for rank, (discord_id, net, spins) in enumerate(rows, start=1):
+        lines.append(f"{rank}. <@{discord_id}> — {'+' if net >= 0 else ''}{net:,} coins over {spins:,} spins")
+    await ctx.send("\n".join(lines), allowed_mentions=discord.AllowedMentions.none())
 
 @bot.command(name="topup")
 async def cmd_topup(ctx, pounds: float):
@@ -254,28 +2815,17 @@ async def cmd_cashout(ctx, paypal_email: str, amount_coins: Optional[int] = None
     Usage: !cashout user@example.com            -> cash out FULL balance
            !cashout user@example.com 300        -> cash out 300 coins
     """
-    await ensure_user(ctx.author.id)
-    bal = await get_balance(ctx.author.id)
-    if bal <= 0:
-        return await ctx.send("❌ You have no coins to cash out.")
-    if amount_coins is None:
-        amount_coins = bal
-    if amount_coins <= 0:
-        return await ctx.send("Enter a positive number of coins to cash out.")
-    if amount_coins > bal:
-        return await ctx.send(f"❌ You only have {bal} coins.")
     # Reserve coins: create ledger payout_request and reduce balance
-    ledger_request_id = await add_ledger_only(ctx.author.id, -amount_coins, "payout_request", f"paypal:{paypal_email}")
-    async with aiosqlite.connect(DB_FILE) as db:
-        await db.execute("UPDATE users SET balance = balance - ? WHERE discord_id = ?", (amount_coins, ctx.author.id))
-        cur = await db.execute("INSERT INTO cashouts (discord_id,paypal_email,amount_coins,status,ledger_request_id) VALUES (?,?,?,?,?)",
-                               (ctx.author.id, paypal_email, amount_coins, "queued", ledger_request_id))
-        await db.commit()
-        # get created id
-        row = await cur.fetchone()  # this is None for aiosqlite after insert; fetch last_insert_rowid
-        cur2 = await db.execute("SELECT last_insert_rowid()")
-        r2 = await cur2.fetchone()
-        cashout_id = r2[0] if r2 else None
+    cashout_id, amount_coins, bal = await request_cashout(ctx.author.id, paypal_email, amount_coins)
+    if cashout_id is None:
+        if bal <= 0:
+            return await ctx.send("❌ You have no coins to cash out.")
+        if amount_coins <= 0:
+            return await ctx.send("Enter a positive number of coins to cash out.")
+        return await ctx.send(f"❌ You only have {bal} coins.")
+    # created_at as CURRENT_TIMESTAMP wrote it (UTC), give or take the moment of the commit
+    cashout_queue.add((cashout_id, ctx.author.id, paypal_email, amount_coins,
+                       datetime.now(timezone.utc).strftime("%Y-%m-%d %H:%M:%S")))
 
     await ctx.send(
         f"💳 Cashout requested: **{amount_coins} coins** ({coins_to_pounds(amount_coins)}) to `{paypal_email}`.\n"
@@ -284,9 +2834,7 @@ async def cmd_cashout(ctx, paypal_email: str, amount_coins: Optional[int] = None
 
 @bot.command(name="status")
 async def cmd_status(ctx):
-    async with aiosqlite.connect(DB_FILE) as db:
-        cur = await db.execute("SELECT id,paypal_email,amount_coins,status,created_at FROM cashouts WHERE discord_id = ? ORDER BY created_at DESC LIMIT 10", (ctx.author.id,))
-        rows = await cur.fetchall()
+    rows = await cashout_queue.user_requests(ctx.author.id)
     if not rows:
         return await ctx.send("You have no cashout requests.")
     lines = ["Your recent cashout requests:"]
@@ -306,16 +2854,25 @@ def admin_check():
 
 @bot.command(name="list_requests")
 @admin_check()
-async def cmd_list_requests(ctx):
-    async with aiosqlite.connect(DB_FILE) as db:
-        cur = await db.execute("SELECT id,discord_id,paypal_email,amount_coins,status,created_at FROM cashouts WHERE status = 'queued' ORDER BY created_at ASC")
-        rows = await cur.fetchall()
-    if not rows:
-        return await ctx.send("No queued cashout requests.")
-    lines = ["Queued cashout requests (ID — user — email — coins — created):"]
-    for r in rows:
-        lines.append(f"{r[0]} — <@{r[1]}> — {r[2]} — {r[3]} coins — {r[5]}")
-    await ctx.send("\n".join(lines))
+async def cmd_list_requests(ctx, *options: str):
+    """
+    Page through the queued cashouts, oldest first, with buttons and filters.
+    Usage: !list_requests
+           !list_requests user=@someone min=500 max=5000
+    """
+    filters = {}
+    for opt in options:
+        key, _, value = opt.partition("=")
+        key = key.lower()
+        if key == "user" and value.strip("<@!>").isdigit():
+            filters["user"] = int(value.strip("<@!>"))
+        elif key in ("min", "max") and value.isdigit():
+            filters[f"{key}_coins"] = int(value)
+        else:
+            return await ctx.send(f"Unknown option `{opt}`. Use user=@someone, min=<coins>, max=<coins>.")
+    view = CashoutQueueView(**filters)
+    content = await view.render()
+    view.message = await ctx.send(content, view=view, allowed_mentions=discord.AllowedMentions.none())
 
 @bot.command(name="approve")
 @admin_check()
@@ -325,17 +2882,13 @@ async def cmd_approve(ctx, request_id: int):
     Mark approved and create ledger entry.
     Then admin should run !markpaid <id> when the payment clears.
     """
-    async with aiosqlite.connect(DB_FILE) as db:
-        cur = await db.execute("SELECT id,discord_id,paypal_email,amount_coins,status FROM cashouts WHERE id = ?", (request_id,))
-        row = await cur.fetchone()
-        if not row:
-            return await ctx.send("Request not found.")
-        if row[4] != "queued":
-            return await ctx.send(f"Request not queued (status {row[4]}).")
-        await db.execute("UPDATE cashouts SET status = 'approved' WHERE id = ?", (request_id,))
-        await db.execute("INSERT INTO ledger (discord_id,type,amount,status,metadata) VALUES (?,?,?,?,?)",
-                         (row[1], "payout_approved", -row[3], "completed", f"admin:{ctx.author.id};paypal:{row[2]};request:{request_id}"))
-        await db.commit()
+    row = await approve_cashout(request_id, ctx.author.id)
+    if not row:
+        return await ctx.send("Request not found.")
+    # approved now, or not queued to begin with
+    cashout_queue.remove(request_id, row[1])
+    if row[4] != "queued":
+        return await ctx.send(f"Request not queued (status {row[4]}).")
     await ctx.send(f"✅ Request {request_id} approved. After you have sent the PayPal payment manually, run `!markpaid {request_id}` to finalize.")
 
 @bot.command(name="markpaid")
@@ -344,18 +2897,12 @@ async def cmd_markpaid(ctx, request_id: int):
     """
     Mark a previously approved cashout as paid (finalize audit trail).
     """
-    async with aiosqlite.connect(DB_FILE) as db:
-        cur = await db.execute("SELECT id,discord_id,amount_coins,status FROM cashouts WHERE id = ?", (request_id,))
-        row = await cur.fetchone()
-        if not row:
-            return await ctx.send("Request not found.")
-        if row[3] == "paid":
-            return await ctx.send("Request already marked as paid.")
-        # Allow markpaid from approved or queued (but ideally approved)
-        await db.execute("UPDATE cashouts SET status = 'paid' WHERE id = ?", (request_id,))
-        await db.execute("INSERT INTO ledger (discord_id,type,amount,status,metadata) VALUES (?,?,?,?,?)",
-                         (row[1], "payout_sent", -row[2], "completed", f"admin:{ctx.author.id};request:{request_id}"))
-        await db.commit()
+    row = await mark_cashout_paid(request_id, ctx.author.id)
+    if not row:
+        return await ctx.send("Request not found.")
+    cashout_queue.remove(request_id, row[1])
+    if row[3] == "paid":
+        return await ctx.send("Request already marked as paid.")
     await ctx.send(f"✅ Request {request_id} marked as PAID. Please notify the user.")
 
 @bot.command(name="reject")
@@ -364,19 +2911,12 @@ async def cmd_reject(ctx, request_id: int, *, reason: str = "rejected by admin")
     """
     Reject a cashout request and refund coins back to user.
     """
-    async with aiosqlite.connect(DB_FILE) as db:
-        cur = await db.execute("SELECT id,discord_id,amount_coins,status FROM cashouts WHERE id = ?", (request_id,))
-        row = await cur.fetchone()
-        if not row:
-            return await ctx.send("Request not found.")
-        if row[3] != "queued":
-            return await ctx.send(f"Cannot reject request with status {row[3]}.")
-        # refund coins
-        await db.execute("UPDATE users SET balance = balance + ? WHERE discord_id = ?", (row[2], row[1]))
-        await db.execute("INSERT INTO ledger (discord_id,type,amount,status,metadata) VALUES (?,?,?,?,?)",
-                         (row[1], "payout_rejected_refund", row[2], "completed", f"request:{request_id};reason:{reason}"))
-        await db.execute("UPDATE cashouts SET status = 'rejected' WHERE id = ?", (request_id,))
-        await db.commit()
+    row = await reject_cashout(request_id, reason)
+    if not row:
+        return await ctx.send("Request not found.")
+    cashout_queue.remove(request_id, row[1])
+    if row[3] != "queued":
+        return await ctx.send(f"Cannot reject request with status {row[3]}.")
     await ctx.send(f"❌ Request {request_id} rejected. {row[2]} coins refunded to <@{row[1]}>. Reason: {reason}")
 
 @bot.command(name="credit")
@@ -389,7 +2929,7 @@ async def cmd_credit(ctx, member: discord.Member, pence: int):
     if pence <= 0:
         return await ctx.send("Enter a positive pence amount (integer). Example: `!credit @user 100` for £1.00")
     coins = pence * PENCE_TO_COINS
-    ledger_id = await change_balance_with_ledger(member.id, coins, "admin_credit", f"credited_by:{ctx.author.id};pence:{pence}")
+    ledger_id = await change_balance_with_ledger(member.id, coins, "admin_credit", f"pence:{pence}", admin_id=ctx.author.id)
     await ctx.send(f"✅ Credited {coins} coins to {member.mention} (ledger id {ledger_id}).")
 
 @bot.command(name="addcoins")
@@ -400,25 +2940,268 @@ async def cmd_addcoins(ctx, member: discord.Member, coins: int):
     """
     if coins == 0:
         return await ctx.send("Specify a non-zero coin amount.")
-    ledger_id = await change_balance_with_ledger(member.id, coins, "admin_credit", f"credited_by:{ctx.author.id};manual_coins:{coins}")
+    ledger_id = await change_balance_with_ledger(member.id, coins, "admin_credit", f"manual_coins:{coins}", admin_id=ctx.author.id)
     await ctx.send(f"✅ Added {coins} coins to {member.mention} (ledger id {ledger_id}).")
 
+async def _run_bulk_cashouts(ctx, action: str, selector: str, reason: str = ""):
+    ids, max_coins, error = parse_id_selector(selector)
+    if error:
+        return await ctx.send(error)
+    rows, problems, more = await bulk_cashout_action(action, ids, max_coins, ctx.author.id, reason)
+    for r in rows:
+        cashout_queue.remove(r[0], r[1])
+    if problems:
+        more = f" (+{len(problems) - 10} more)" if len(problems) > 10 else ""
+        return await ctx.send(f"❌ Nothing changed — {len(problems)} requests can't be {BULK_CASHOUT_ACTIONS[action][1]}: "
+                              + ", ".join(problems[:10]) + more)
+    if not rows:
+        return await ctx.send("No matching cashout requests.")
+    total = sum(r[3] for r in rows)
+    await ctx.send(f"✅ {BULK_CASHOUT_ACTIONS[action][1].capitalize()} {len(rows)} requests — {total:,} coins ({coins_to_pounds(total)}) "
+                   f"across {len({r[1] for r in rows})} users — ids {format_id_ranges([r[0] for r in rows])}"
+                   + (f"\n⚠️ Only the first {BULK_MAX_ROWS:,} matching requests were handled; run `!bulk_{action} {selector}` "
+                      f"again for the rest." if more else ""))
+
+@bot.command(name="bulk_approve")
+@admin_check()
+async def cmd_bulk_approve(ctx, *, selector: str):
+    """
+    Approve many queued cashouts at once: !bulk_approve 12-40,45 | all | under:500
+    """
+    await _run_bulk_cashouts(ctx, "approve", selector)
+
+@bot.command(name="bulk_markpaid")
+@admin_check()
+async def cmd_bulk_markpaid(ctx, *, selector: str):
+    """
+    Mark many cashouts paid after a payment run: !bulk_markpaid 12-40,45 | all | under:500
+    "all" / "under:N" pick approved requests; listed ids may also be queued, like !markpaid.
+    """
+    await _run_bulk_cashouts(ctx, "markpaid", selector)
+
+@bot.command(name="bulk_reject")
+@admin_check()
+async def cmd_bulk_reject(ctx, selector: str, *, reason: str = "rejected by admin"):
+    """
+    Reject and refund many queued cashouts: !bulk_reject 12-40,45 [reason] (no spaces in the ids)
+    """
+    await _run_bulk_cashouts(ctx, "reject", selector, reason)
+
+@bot.command(name="bulk_credit")
+@admin_check()
+async def cmd_bulk_credit(ctx):
+    """
+    Credit many users from an attached CSV: discord_id,coins[,note] per line, or a header row
+    with discord_id and coins or pence columns. All rows apply together or not at all.
+    """
+    attachments = getattr(ctx.message, "attachments", None)
+    if not attachments:
+        return await ctx.send("Attach a CSV file: `discord_id,coins[,note]` per line (or a header with a `pence` column).")
+    attachment = attachments[0]
+    if attachment.size > 1_000_000:
+        return await ctx.send("That file is too large (1 MB max).")
+    try:
+        text = (await attachment.read()).decode("utf-8-sig")
+    except UnicodeDecodeError:
+        return await ctx.send("The file is not UTF-8 text.")
+    rows, problems = parse_credit_csv(text)
+    if not problems:
+        balances, problems = await bulk_credit(rows, ctx.author.id, attachment.filename.replace(";", ","))
+    if problems:
+        more = f" (+{len(problems) - 10} more)" if len(problems) > 10 else ""
+        return await ctx.send(f"❌ Nothing credited — {len(problems)} problems: " + ", ".join(problems[:10]) + more,
+                              allowed_mentions=discord.AllowedMentions.none())
+    total = sum(r[1] for r in rows)
+    await ctx.send(f"✅ Credited {total:,} coins ({coins_to_pounds(total)}) in {len(rows)} rows to {len(balances)} users "
+                   f"from `{attachment.filename}`.")
+
 @bot.command(name="ledger")
 @admin_check()
-async def cmd_ledger(ctx, limit: int = 20):
-    async with aiosqlite.connect(DB_FILE) as db:
-        cur = await db.execute("SELECT id,discord_id,type,amount,status,metadata,created_at FROM ledger ORDER BY created_at DESC LIMIT ?", (limit,))
-        rows = await cur.fetchall()
+async def cmd_ledger(ctx, limit: int = 20, before: Optional[int] = None, *options: str):
+    """
+    Page through the ledger, newest first.
+    Usage: !ledger 20                 -> latest 20 rows
+           !ledger 20 1234            -> 20 rows older than ledger id 1234
+           !ledger 20 0 user=@someone type=bet
+           !ledger 20 0 request=123         -> every row for cashout #123
+    """
+    limit = max(1, min(limit, LEDGER_PAGE_MAX))
+    filters, _, _, error = parse_export_options(options)
+    if error:
+        return await ctx.send(error)
+    rows = await fetch_page("ledger", filters, before or None, limit, descending=True)
     if not rows:
-        return await ctx.send("Ledger is empty.")
-    lines = ["Recent ledger rows (id — user — type — amount — status — metadata — time):"]
+        return await ctx.send("Ledger is empty." if not before and not filters else "No more ledger rows.")
+    lines = ["Recent ledger rows (id — user — type — amount — status — details — time):"]
     for r in rows:
-        lines.append(f"{r[0]} — <@{r[1]}> — {r[2]} — {r[3]} coins — {r[4]} — {r[5]} — {r[6]}")
-    # split into multiple messages if too long
-    chunk_size = 1800
-    message = "\n".join(lines)
-    for i in range(0, len(message), chunk_size):
-        await ctx.send(message[i:i+chunk_size])
+        details = [f"request #{r[5]}"] if r[5] is not None else []
+        details += [f"admin <@{r[6]}>"] if r[6] is not None else []
+        details += [r[7]] if r[7] else []
+        details += [r[8]] if r[8] else []
+        lines.append(f"{r[0]} — <@{r[1]}> — {r[2]} — {r[3]} coins — {r[4]} — {', '.join(details) or '-'} — {r[9]}")
+    if len(rows) == limit:
+        lines.append(f"Older rows: `!ledger {limit} {rows[-1][0]}{''.join(' ' + o for o in options)}`")
+    await send_lines(ctx, lines)
+
+@bot.command(name="export")
+@admin_check()
+async def cmd_export(ctx, table: str = "ledger", *options: str):
+    """
+    Export full history as a file attachment, streamed page by page.
+    Usage: !export ledger
+           !export ledger user=@someone type=bet since=2024-01-01 until=2024-02-01 format=jsonl gzip
+           !export spins user=123456789
+           !export cashouts type=paid         (type= filters cashout status)
+    """
+    table = table.lower()
+    if table not in EXPORT_TABLES:
+        return await ctx.send(f"Unknown table `{table}`. Choose one of: {', '.join(EXPORT_TABLES)}.")
+    filters, fmt, compress, error = parse_export_options(options)
+    if error:
+        return await ctx.send(error)
+    unsupported = unsupported_filters(table, filters)
+    if unsupported:
+        return await ctx.send(f"`{table}` can't be filtered by {', '.join(k + '=' for k in unsupported)}.")
+    await ctx.send(f"⏳ Exporting `{table}`…")
+    path, rows = await export_table(table, filters, fmt, compress)
+    try:
+        size = os.path.getsize(path)
+        limit = ctx.guild.filesize_limit if ctx.guild else 10 * 1024 * 1024
+        if size > limit:
+            # the only case a file stays on disk: it holds emails and user ids, so delete it once fetched
+            kept = await asyncio.to_thread(keep_export, path)
+            return await ctx.send(f"✅ Exported {rows} rows ({size / 1024 / 1024:.1f} MB) — too large to attach here (try `gzip`). "
+                                  f"Saved to `{kept}` on the bot host; delete it once you have copied it.")
+        await ctx.send(f"✅ Exported {rows} rows from `{table}`.", file=discord.File(path, filename=os.path.basename(path)))
+    finally:
+        await asyncio.to_thread(discard_export, path)
+
+@bot.command(name="dbstats")
+@admin_check()
+async def cmd_dbstats(ctx):
+    w = await writer_stats()
+    avg_ms = (w["total_flush_seconds"] / w["flushes"] * 1000) if w["flushes"] else 0.0
+    lookups = w["cache_hits"] + w["cache_misses"]
+    hit_rate = (w["cache_hits"] / lookups * 100) if lookups else 0.0
+    lines = [
+        "🗄️ **DB stats**",
+        f"Spin writer: {w['flushes']} flushes — {w['spins_written']} spins written — {w['spins_rejected']} rejected — {w['flush_errors']} errors",
+        f"Flush latency: last {w['last_flush_seconds'] * 1000:.1f} ms — avg {avg_ms:.1f} ms — max {w['max_flush_seconds'] * 1000:.1f} ms",
+        f"Batch size {w['batch_size']} — flush interval {w['flush_interval'] * 1000:.0f} ms",
+        f"Balance cache: {w['cache_size']}/{w['cache_max_size']} users — {w['cache_hits']} hits — {w['cache_misses']} misses "
+        f"({hit_rate:.1f}% hit) — {w['cache_evictions']} evictions",
+        f"Win announcer: queue {win_announcer.depth}/{win_announcer.max_queue} — {win_announcer.sent_wins} wins in {win_announcer.sent_messages} messages — "
+        f"{win_announcer.merged} merged on overflow — {win_announcer.send_failures} send failures",
+    ]
+    await ctx.send("\n".join(lines))
+
+@bot.command(name="rebuild_stats")
+@admin_check()
+async def cmd_rebuild_stats(ctx):
+    """Recomputes user_stats from the full spin / ledger / cashout history."""
+    started = time.perf_counter()
+    users = await rebuild_user_stats()
+    await ctx.send(f"📊 Rebuilt stats for {users} users in {time.perf_counter() - started:.2f}s.")
+
+@bot.command(name="reconcile")
+@admin_check()
+async def cmd_reconcile(ctx, mode: str = "run"):
+    """
+    Check balances against the ledger, only looking at rows added since the last check.
+    Usage: !reconcile          -> incremental check
+           !reconcile full     -> rebuild every checkpoint from the whole ledger
+           !reconcile last     -> show the previous result
+    """
+    if mode == "last":
+        report = await get_last_reconcile()
+        if report is None:
+            return await ctx.send("No reconciliation has run since the bot started.")
+    else:
+        report = await reconcile(full=(mode == "full"))
+    if report.to_id == report.from_id:
+        lines = [f"🧾 No new ledger rows since id {report.to_id}."]
+    else:
+        lines = [f"🧾 Reconciled ledger ids {report.from_id + 1}–{report.to_id}: {report.rows} rows, {report.users} users in {report.seconds * 1000:.0f} ms"]
+    if report.mismatches:
+        lines.append(f"⚠️ {len(report.mismatches)} mismatches (user — balance — ledger says):")
+        for discord_id, balance, expected in report.mismatches:
+            lines.append(f"<@{discord_id}> — {balance} — {expected}")
+    else:
+        lines.append("✅ All checked balances match the ledger.")
+    await send_lines(ctx, lines)
+
+@bot.command(name="archive")
+@admin_check()
+async def cmd_archive(ctx, mode: str = "run", days: Optional[float] = None):
+    """
+    Move old ledger / spins rows into the per-month archive files.
+    Usage: !archive            -> archive rows older than ARCHIVE_AFTER_DAYS
+           !archive run 30     -> archive rows older than 30 days
+           !archive list       -> show the archive files
+    """
+    if mode == "list":
+        async with db_pool.acquire() as db:
+            archives = await archive_catalog(db)
+        if not archives:
+            return await ctx.send("Nothing has been archived yet.")
+        lines = ["🗃️ Archive files (month — ledger rows — spins — last written):"]
+        for month, path, ledger_rows, spin_rows, archived_at in archives:
+            lines.append(f"{month} — {ledger_rows:,} — {spin_rows:,} — {archived_at} — `{path}`")
+        return await send_lines(ctx, lines)
+    days = ARCHIVE_AFTER_DAYS if days is None else days
+    if days < 0:
+        return await ctx.send("Days must be zero or more.")
+    try:
+        report = await archive_old_rows(days)
+    except RuntimeError as e:
+        return await ctx.send(f"❌ {e}. Run `!reconcile` for details.")
+    if not report.months:
+        return await ctx.send(f"🗃️ Nothing older than {days:g} days left to archive.")
+    await ctx.send(f"🗃️ Archived {report.ledger_rows:,} ledger rows and {report.spin_rows:,} spins (ledger ids up to {report.through_id}) "
+                   f"into {', '.join(report.months)} in {report.seconds:.2f}s; carried {report.users} balances forward.")
+
+@bot.command(name="backup")
+@admin_check()
+async def cmd_backup(ctx, mode: str = "run"):
+    """
+    Take a compressed, integrity-checked snapshot of casino.db (and changed archive files) while the bot keeps running.
+    Usage: !backup          -> back up now
+           !backup last     -> show the most recent backup
+    """
+    if mode == "last":
+        report = await get_last_backup()
+        if report is None:
+            return await ctx.send("No backup has run since the bot started.")
+    else:
+        await ctx.send("⏳ Backing up casino.db…")
+        try:
+            report = await backup_database()
+        except (RuntimeError, OSError, sqlite3.Error) as e:
+            return await ctx.send(f"❌ Backup failed: {e}")
+    await ctx.send(f"💾 `{report.path}` — {report.pages:,} pages, {report.db_bytes / 1024 / 1024:.1f} MB "
+                   f"→ {report.gz_bytes / 1024 / 1024:.1f} MB compressed, integrity ok, {report.seconds:.2f}s"
+                   + (f"; copied archives {', '.join(report.archives)}" if report.archives else "")
+                   + (f"; deleted {report.removed} old backup files" if report.removed else ""))
+
+@bot.command(name="profile")
+@admin_check()
+async def cmd_profile(ctx, action: str = "report"):
+    """
+    Sampling profiler for finding hot spots in production.
+    Usage: !profile start | !profile stop | !profile report
+    Raw collapsed stacks are also served on /profile when METRICS_PORT is set.
+    """
+    if action == "start":
+        profiler.start(threading.get_ident())
+        return await ctx.send(f"🔬 Sampling profiler started ({profiler.interval * 1000:.0f} ms interval).")
+    if action == "stop":
+        profiler.stop()
+    hot = profiler.report()
+    if not hot:
+        return await ctx.send("No profiler samples yet. Use `!profile start` first.")
+    lines = [f"🔬 Profiler {'running' if profiler.running else 'stopped'} — {profiler.total} samples; hottest frames (% of samples):"]
+    lines.extend(f"{pct:5.1f}%  {frame}" for pct, frame in hot)
+    await send_lines(ctx, lines)
 
 # -------------------------
 # Utility commands
@@ -426,14 +3209,13 @@ async def cmd_ledger(ctx, limit: int = 20):
 @bot.command(name="lastspins")
 async def cmd_lastspins(ctx, member: Optional[discord.Member] = None, limit: int = 5):
     target = member or ctx.author
-    async with aiosqlite.connect(DB_FILE) as db:
-        cur = await db.execute("SELECT s1,s2,s3,won,created_at FROM spins WHERE discord_id = ? ORDER BY created_at DESC LIMIT ?", (target.id, limit))
-        rows = await cur.fetchall()
+    rows = await recent_spins(target.id, limit)
     if not rows:
         return await ctx.send("No spins found.")
     lines = [f"Last {len(rows)} spins for {target.display_name}:"]
-    for r in rows:
-        lines.append(f"[{r[0]}] [{r[1]}] [{r[2]}] → {r[3]} coins ({r[4]})")
+    for outcome, won, created_at in rows:
+        s1, s2, s3 = stored_symbols(outcome)
+        lines.append(f"[{s1}] [{s2}] [{s3}] → {won} coins ({created_at})")
     await ctx.send("\n".join(lines))
 
 # -------------------------
@@ -445,7 +3227,6 @@ async def on_ready():
         print("ERROR: No Discord token provided. Set DISCORD_TOKEN env var or edit DEFAULT_TOKEN.")
         await bot.close()
         return
-    await init_db()
     print(f"Bot ready: {bot.user} (ID {bot.user.id})")
     if ANNOUNCE_CHANNEL_ID:
         print(f"Announce channel id set to {ANNOUNCE_CHANNEL_ID}")
@@ -455,6 +3236,8 @@ async def on_ready():
 # Helpful friendly error for admin permission missing
 @bot.event
 async def on_command_error(ctx, error):
+    metrics.inc("casino_command_errors_total", command=ctx.command.qualified_name if ctx.command else "unknown",
+                error=type(error).__name__)
     if isinstance(error, commands.MissingPermissions):
         await ctx.send("❌ You do not have permission to use that command.")
     elif isinstance(error, commands.BadArgument):
@@ -471,6 +3254,9 @@ if __name__ == "__main__":
     # Optionally load env defaults if not provided above
     if not TOKEN:
         TOKEN = os.getenv("DISCORD_TOKEN")
+    if ROLE == "writer":
+        asyncio.run(run_writer())
+        sys.exit(0)
     try:
         bot.run(TOKEN)
     except Exception as e:
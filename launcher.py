@@ -0,0 +1,154 @@
+# launcher.py — Runs the bot as one DB writer process plus several gateway shard processes
+# Requires: Python 3.10+, plus bot.py's requirements (Linux / macOS: the writer listens on a Unix socket)
+# The writer owns casino.db (migrations, spin group commit, balance cache, reconcile / archive
+# jobs); each shard process runs a contiguous range of gateway shards, reads casino.db
+# read-only and sends every balance / ledger change to the writer. Crashed processes are
+# restarted with backoff; SIGINT / SIGTERM stops the shards first, then the writer.
+#
+# Usage: DISCORD_TOKEN=... python launcher.py                     -> one shard process per spare CPU core
+#        DISCORD_TOKEN=... python launcher.py --processes 4 --shards 16
+# If METRICS_PORT is set the writer serves /metrics there and shard process i on METRICS_PORT + 1 + i.
+
+import argparse
+import os
+import signal
+import socket
+import subprocess
+import sys
+import time
+
+BOT = os.path.join(os.path.dirname(os.path.abspath(__file__)), "bot.py")
+
+class Child:
+    """One supervised bot.py process."""
+
+    def __init__(self, name: str, env: dict):
+        self.name = name
+        self.env = env
+        self.proc = None
+        self.started_at = 0.0
+        self.restart_at = 0.0
+        self.backoff = 1.0
+        self.restarts = 0
+
+    def start(self):
+        self.proc = subprocess.Popen([sys.executable, BOT], env=self.env)
+        self.started_at = time.monotonic()
+        print(f"[launcher] started {self.name} (pid {self.proc.pid})", flush=True)
+
+    def check(self, max_backoff: float):
+        """Restarts the process if it exited, backing off while it keeps dying right after start."""
+        if self.proc is None or self.proc.poll() is None:
+            return
+        now = time.monotonic()
+        if not self.restart_at:
+            uptime = now - self.started_at
+            self.backoff = 1.0 if uptime > 60 else min(self.backoff * 2, max_backoff)
+            self.restart_at = now + self.backoff
+            print(f"[launcher] {self.name} exited with {self.proc.returncode} after {uptime:.0f}s; "
+                  f"restarting in {self.backoff:.0f}s", flush=True)
+        elif now >= self.restart_at:
+            self.restart_at = 0.0
+            self.restarts += 1
+            self.start()
+
+    def stop(self, timeout: float):
+        if self.proc is None or self.proc.poll() is not None:
+            return
+        self.proc.send_signal(signal.SIGTERM)
+        try:
+            self.proc.wait(timeout)
+        except subprocess.TimeoutExpired:
+            print(f"[launcher] {self.name} did not stop in {timeout:.0f}s; killing it", flush=True)
+            self.proc.kill()
+            self.proc.wait()
+
+def shard_ranges(shards: int, processes: int) -> list:
+    """Splits shard ids 0..shards-1 into contiguous ranges, one per process."""
+    base, extra = divmod(shards, processes)
+    ranges, start = [], 0
+    for i in range(processes):
+        n = base + (1 if i < extra else 0)
+        if n:
+            ranges.append(list(range(start, start + n)))
+        start += n
+    return ranges
+
+def wait_for_socket(path: str, writer: Child, timeout: float) -> bool:
+    deadline = time.monotonic() + timeout
+    while time.monotonic() < deadline:
+        if writer.proc.poll() is not None:
+            return False
+        with socket.socket(socket.AF_UNIX, socket.SOCK_STREAM) as s:
+            try:
+                s.connect(path)
+                return True
+            except (FileNotFoundError, ConnectionRefusedError):
+                time.sleep(0.2)
+    return False
+
+def main(argv=None) -> int:
+    ap = argparse.ArgumentParser(description="Run the casino bot as a DB writer plus supervised shard processes.")
+    ap.add_argument("--processes", type=int, default=max(1, (os.cpu_count() or 2) - 1), help="shard processes to run")
+    ap.add_argument("--shards", type=int, default=None, help="total gateway shards (default: one per process)")
+    ap.add_argument("--socket", default=os.getenv("WRITER_SOCKET") or "casino-writer.sock", help="writer's Unix socket path")
+    ap.add_argument("--writer-timeout", type=float, default=60, help="seconds to wait for the writer to start serving")
+    ap.add_argument("--stop-timeout", type=float, default=30, help="seconds a process gets to exit before it is killed")
+    ap.add_argument("--max-backoff", type=float, default=60, help="longest wait before restarting a crashing process")
+    args = ap.parse_args(argv)
+    if not os.getenv("DISCORD_TOKEN"):
+        print("ERROR: set DISCORD_TOKEN for the shard processes.")
+        return 1
+    shards = args.shards or args.processes
+    if shards < args.processes:
+        print("ERROR: --shards must be at least --processes.")
+        return 1
+
+    socket_path = os.path.abspath(args.socket)
+    metrics_port = int(os.environ["METRICS_PORT"]) if os.getenv("METRICS_PORT") else None
+    common = dict(os.environ, WRITER_SOCKET=socket_path, PYTHONUNBUFFERED="1")
+    writer_env = dict(common, CASINO_ROLE="writer")
+    if metrics_port:
+        writer_env["METRICS_PORT"] = str(metrics_port)
+    writer = Child("writer", writer_env)
+    children = []
+    for i, ids in enumerate(shard_ranges(shards, args.processes)):
+        env = dict(common, CASINO_ROLE="shard", SHARD_COUNT=str(shards), SHARD_IDS=",".join(map(str, ids)))
+        if metrics_port:
+            env["METRICS_PORT"] = str(metrics_port + 1 + i)
+        children.append(Child(f"shard {ids[0]}-{ids[-1]}" if len(ids) > 1 else f"shard {ids[0]}", env))
+
+    stopping = False
+
+    def request_stop(signum, frame):
+        nonlocal stopping
+        stopping = True
+
+    signal.signal(signal.SIGINT, request_stop)
+    signal.signal(signal.SIGTERM, request_stop)
+
+    writer.start()
+    if not wait_for_socket(socket_path, writer, args.writer_timeout):
+        print("ERROR: the DB writer did not start serving; see its output above.")
+        writer.stop(args.stop_timeout)
+        return 1
+    for child in children:
+        child.start()
+
+    while not stopping:
+        # shards reconnect to a restarted writer on their next call
+        for child in [writer, *children]:
+            child.check(args.max_backoff)
+        time.sleep(0.5)
+
+    print("[launcher] stopping shards, then the writer", flush=True)
+    for child in children:
+        if child.proc is not None and child.proc.poll() is None:
+            child.proc.send_signal(signal.SIGTERM)
+    for child in children:
+        child.stop(args.stop_timeout)
+    writer.stop(args.stop_timeout)
+    return 0
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,247 @@
+# loadtest.py — Concurrent load test for the casino bot, no Discord server needed
+# Requires: Python 3.10+, plus bot.py's requirements
+# Calls the registered command callbacks directly with stub ctx/author objects against a
+# throwaway casino.db, then checks that every users.balance still matches the ledger.
+#
+# Usage: python loadtest.py                                  -> 2000 users x 20 commands
+#        python loadtest.py --users 5000 --batch-size 512 --flush-ms 2 --pool-size 8
+# Exits non-zero if any balance disagrees with the ledger or a command raised.
+
+import argparse
+import asyncio
+import os
+import random
+import sqlite3
+import sys
+import tempfile
+import time
+from collections import defaultdict
+
+import bot
+
+# -------------------------
+# Stub Discord objects
+# -------------------------
+class FakePermissions:
+    def __init__(self, administrator: bool):
+        self.administrator = administrator
+
+class FakeAuthor:
+    def __init__(self, discord_id: int, admin: bool = False):
+        self.id = discord_id
+        self.name = self.display_name = f"user{discord_id}"
+        self.mention = f"<@{discord_id}>"
+        self.guild_permissions = FakePermissions(admin)
+
+class FakeContext:
+    """Just enough of commands.Context for the command bodies: author, guild and send()."""
+
+    def __init__(self, author: FakeAuthor, send_latency: float):
+        self.author = author
+        self.guild = None
+        self.send_latency = send_latency
+        self.messages = []
+
+    async def send(self, content=None, **kwargs):
+        if self.send_latency:
+            await asyncio.sleep(self.send_latency)
+        self.messages.append(content)
+
+# -------------------------
+# Workload
+# -------------------------
+DEFAULT_MIX = "spin=70,balance=12,multispin=4,cashout=4,status=4,lastspins=4,prizes=2,stats=2,leaderboard=1"
+ADMIN_MIX = "approve=40,markpaid=30,reject=20,ledger=5,list_requests=5,bulk_approve=2,bulk_markpaid=2,bulk_reject=2"
+
+def parse_mix(text: str) -> tuple:
+    names, weights = [], []
+    for part in text.split(","):
+        name, _, weight = part.partition("=")
+        names.append(name.strip())
+        weights.append(float(weight or 1))
+    return names, weights
+
+class Stats:
+    def __init__(self):
+        self.latencies = defaultdict(list)
+        self.errors = defaultdict(int)
+
+    async def timed(self, name: str, coro):
+        started = time.perf_counter()
+        try:
+            await coro
+        except Exception as e:
+            self.errors[name] += 1
+            if self.errors[name] == 1:
+                print(f"{name} raised: {e!r}")
+        self.latencies[name].append(time.perf_counter() - started)
+
+def percentile(sorted_values: list, pct: float) -> float:
+    if not sorted_values:
+        return 0.0
+    k = min(len(sorted_values) - 1, int(round(pct / 100 * (len(sorted_values) - 1))))
+    return sorted_values[k]
+
+async def user_session(discord_id: int, args, stats: Stats):
+    names, weights = parse_mix(args.mix)
+    author = FakeAuthor(discord_id)
+    for _ in range(args.ops):
+        name = random.choices(names, weights)[0]
+        ctx = FakeContext(author, args.send_latency_ms / 1000)
+        if name == "spin":
+            coro = bot.cmd_spin.callback(ctx)
+        elif name == "multispin":
+            coro = bot.cmd_multispin.callback(ctx, random.randint(2, 50))
+        elif name == "balance":
+            coro = bot.cmd_balance.callback(ctx)
+        elif name == "cashout":
+            coro = bot.cmd_cashout.callback(ctx, f"user{discord_id}@example.com", random.randint(10, 200))
+        elif name == "status":
+            coro = bot.cmd_status.callback(ctx)
+        elif name == "lastspins":
+            coro = bot.cmd_lastspins.callback(ctx, None, 5)
+        elif name == "prizes":
+            coro = bot.cmd_prizes.callback(ctx)
+        elif name == "stats":
+            coro = bot.cmd_stats.callback(ctx, None)
+        elif name == "leaderboard":
+            coro = bot.cmd_leaderboard.callback(ctx)
+        else:
+            raise SystemExit(f"Unknown command in --mix: {name}")
+        await stats.timed(name, coro)
+        if args.think_ms:
+            await asyncio.sleep(random.random() * args.think_ms / 1000)
+
+async def next_cashout_id(statuses: tuple):
+    marks = ",".join("?" * len(statuses))
+    async with bot.db_pool.acquire() as db:
+        rows = await db.execute_fetchall(
+            f"SELECT id FROM cashouts WHERE status IN ({marks}) ORDER BY id LIMIT 20", statuses)
+    return random.choice(rows)[0] if rows else None
+
+async def admin_session(admin_id: int, stop: asyncio.Event, args, stats: Stats):
+    names, weights = parse_mix(ADMIN_MIX)
+    author = FakeAuthor(admin_id, admin=True)
+    while not stop.is_set():
+        name = random.choices(names, weights)[0]
+        ctx = FakeContext(author, args.send_latency_ms / 1000)
+        if name in ("approve", "reject"):
+            request_id = await next_cashout_id(("queued",))
+        elif name == "markpaid":
+            request_id = await next_cashout_id(("approved",))
+        else:
+            request_id = None
+        if name == "approve" and request_id:
+            await stats.timed(name, bot.cmd_approve.callback(ctx, request_id))
+        elif name == "markpaid" and request_id:
+            await stats.timed(name, bot.cmd_markpaid.callback(ctx, request_id))
+        elif name == "reject" and request_id:
+            await stats.timed(name, bot.cmd_reject.callback(ctx, request_id, reason="load test"))
+        elif name == "ledger":
+            await stats.timed(name, bot.cmd_ledger.callback(ctx, 20))
+        elif name == "list_requests":
+            await stats.timed(name, bot.cmd_list_requests.callback(ctx))
+        elif name == "bulk_approve":
+            await stats.timed(name, bot.cmd_bulk_approve.callback(ctx, selector=f"under:{random.randint(20, 200)}"))
+        elif name == "bulk_markpaid":
+            await stats.timed(name, bot.cmd_bulk_markpaid.callback(ctx, selector="all"))
+        elif name == "bulk_reject":
+            request_id = await next_cashout_id(("queued",))
+            if request_id:
+                await stats.timed(name, bot.cmd_bulk_reject.callback(ctx, f"{request_id}-{request_id + 5}", reason="load test"))
+        await asyncio.sleep(args.admin_interval_ms / 1000)
+
+# -------------------------
+# Consistency check
+# -------------------------
+def balance_mismatches(db_file: str) -> list:
+    """Users whose balance differs from the sum of their balance-moving ledger rows."""
+    marks = ",".join("?" * len(bot.AUDIT_ONLY_LEDGER_TYPES))
+    with sqlite3.connect(db_file) as conn:
+        return conn.execute(f"""
+            SELECT u.discord_id, u.balance, COALESCE(l.total, 0)
+            FROM users u
+            LEFT JOIN (SELECT discord_id, SUM(amount) AS total FROM ledger
+                       WHERE type NOT IN ({marks}) GROUP BY discord_id) l ON l.discord_id = u.discord_id
+            WHERE u.balance != COALESCE(l.total, 0)
+        """, bot.AUDIT_ONLY_LEDGER_TYPES).fetchall()
+
+# -------------------------
+# Driver
+# -------------------------
+async def run(args) -> int:
+    bot.DB_FILE = args.db
+    if args.pool_size:
+        bot.db_pool.size = args.pool_size
+    if args.batch_size:
+        bot.spin_writer.batch_size = args.batch_size
+    if args.flush_ms is not None:
+        bot.spin_writer.flush_interval = args.flush_ms / 1000
+    await bot.init_db()
+
+    user_ids = [10_000 + i for i in range(args.users)]
+    for discord_id in user_ids:
+        await bot.change_balance_with_ledger(discord_id, args.start_coins, "admin_credit", "loadtest:seed")
+
+    stats = Stats()
+    stop = asyncio.Event()
+    admins = [asyncio.create_task(admin_session(1 + i, stop, args, stats)) for i in range(args.admins)]
+    started = time.perf_counter()
+    await asyncio.gather(*(user_session(d, args, stats) for d in user_ids))
+    elapsed = time.perf_counter() - started
+    stop.set()
+    await asyncio.gather(*admins)
+    # the writer's counters (from the writer process when run as CASINO_ROLE=shard)
+    w = await bot.writer_stats()
+    await bot.close_db()
+
+    total = sum(len(v) for v in stats.latencies.values())
+    print(f"🎰 Load test — {args.users} users, {total:,} commands in {elapsed:.2f}s ({total / elapsed:,.0f} cmd/s)")
+    print(f"pool {bot.db_pool.size} conns | spin batch {w['batch_size']} | flush {w['flush_interval'] * 1000:.1f} ms | db {args.db}")
+    print()
+    print(f"{'command':<15}{'count':>8}{'errors':>8}{'p50 ms':>10}{'p95 ms':>10}{'p99 ms':>10}{'max ms':>10}")
+    for name in sorted(stats.latencies):
+        values = sorted(stats.latencies[name])
+        print(f"{name:<15}{len(values):>8}{stats.errors[name]:>8}"
+              + "".join(f"{percentile(values, p) * 1000:>10.2f}" for p in (50, 95, 99))
+              + f"{values[-1] * 1000:>10.2f}")
+    print()
+    avg_flush = w["total_flush_seconds"] / w["flushes"] * 1000 if w["flushes"] else 0.0
+    print(f"Spin writer: {w['flushes']} flushes, {w['spins_written']} spins ({w['spins_written'] / max(w['flushes'], 1):.1f}/flush), "
+          f"avg flush {avg_flush:.2f} ms, max {w['max_flush_seconds'] * 1000:.2f} ms")
+    print(f"Balance cache: {w['cache_hits']} hits, {w['cache_misses']} misses")
+
+    mismatches = balance_mismatches(args.db)
+    print()
+    if mismatches:
+        print(f"FAIL: {len(mismatches)} users' balance disagrees with the ledger, e.g. (id, balance, ledger) {mismatches[:5]}")
+        return 1
+    if any(stats.errors.values()):
+        print(f"FAIL: commands raised errors: {dict(stats.errors)}")
+        return 1
+    print("OK: every balance matches the ledger")
+    return 0
+
+def main(argv=None) -> int:
+    ap = argparse.ArgumentParser(description="Concurrent load test for the casino bot commands.")
+    ap.add_argument("--users", type=int, default=2000, help="concurrent simulated users")
+    ap.add_argument("--ops", type=int, default=20, help="commands per user")
+    ap.add_argument("--mix", default=DEFAULT_MIX, help="weighted command mix, e.g. spin=80,balance=20")
+    ap.add_argument("--admins", type=int, default=2, help="admins working the cashout queue meanwhile")
+    ap.add_argument("--admin-interval-ms", type=float, default=20, help="pause between admin commands")
+    ap.add_argument("--start-coins", type=int, default=2000, help="coins credited to each user first")
+    ap.add_argument("--think-ms", type=float, default=0, help="max random pause between a user's commands")
+    ap.add_argument("--send-latency-ms", type=float, default=0, help="simulated Discord latency per ctx.send")
+    ap.add_argument("--pool-size", type=int, default=None, help="override DB_POOL_SIZE")
+    ap.add_argument("--batch-size", type=int, default=None, help="override SPIN_BATCH_SIZE")
+    ap.add_argument("--flush-ms", type=float, default=None, help="override SPIN_FLUSH_MS")
+    ap.add_argument("--db", default=None, help="database file (default: a fresh temp file)")
+    ap.add_argument("--seed", type=int, default=None)
+    args = ap.parse_args(argv)
+    if args.db is None:
+        args.db = os.path.join(tempfile.mkdtemp(prefix="casino-loadtest-"), "casino.db")
+    random.seed(args.seed)
+    return asyncio.run(run(args))
+
+if __name__ == "__main__":
+    sys.exit(main())
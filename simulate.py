@@ -0,0 +1,195 @@
+# simulate.py — Offline Monte Carlo RTP / volatility check for the slot paytable
+# Requires: Python 3.10+, pip install numpy (plus bot.py's requirements, for its config)
+# Uses the exact SYMBOLS / SYMBOL_WEIGHTS / PRIZES / SPIN_COST that !spin uses.
+#
+# Usage: python simulate.py                          -> 100M spins on every CPU core
+#        python simulate.py --spins 500000000 --max-rtp 0.97
+# Exits non-zero if the simulation disagrees with the exact expectation, or the exact
+# RTP falls outside --min-rtp/--max-rtp, so it can gate a paytable change before deploy.
+
+import argparse
+import math
+import os
+import sys
+import time
+from concurrent.futures import ProcessPoolExecutor
+
+import numpy as np
+
+import bot
+
+# -------------------------
+# Paytable (shared with the bot)
+# -------------------------
+# Outcomes use the bot's packed encoding, so index i here is bot.OUTCOME_SYMBOLS[i].
+PAYOUTS = np.array(bot.PAYOUTS, dtype=np.int64)
+SPIN_COST = bot.SPIN_COST
+
+def outcome_probabilities() -> np.ndarray:
+    w = np.array(bot.SYMBOL_WEIGHTS, dtype=np.float64)
+    p = w / w.sum()
+    # P(c1, c2, c3) = p[c1] * p[c2] * p[c3], flattened in the same order as encode_outcome()
+    return np.einsum("i,j,k->ijk", p, p, p).ravel()
+
+PROBS = outcome_probabilities()
+
+def _ticket_table():
+    """
+    With integer weights each reel is a strip of W = sum(weights) equally likely stops, so a
+    whole spin is one uniform ticket in [0, W**3) — three independent reels, one draw.
+    Returns the ticket -> packed outcome table, or None if the weights are not integers or
+    the table would be too large (draw_outcomes then spins the three reels separately).
+    """
+    weights = bot.SYMBOL_WEIGHTS
+    if not all(float(w).is_integer() and w >= 0 for w in weights):
+        return None
+    stops = np.repeat(np.arange(len(weights)), np.array(weights, dtype=np.int64))
+    if len(stops) ** 3 > 1 << 22:
+        return None
+    n = len(weights)
+    table = (stops[:, None, None] * n + stops[None, :, None]) * n + stops[None, None, :]
+    return table.ravel().astype(np.min_scalar_type(len(PAYOUTS) - 1))
+
+TICKET_OUTCOMES = _ticket_table()
+REEL_CUM_PROBS = np.cumsum(np.array(bot.SYMBOL_WEIGHTS, dtype=np.float64) / sum(bot.SYMBOL_WEIGHTS))
+REEL_CUM_PROBS[-1] = 1.0
+
+def exact_stats() -> dict:
+    mean = float(PROBS @ PAYOUTS)
+    second = float(PROBS @ (PAYOUTS.astype(np.float64) ** 2))
+    return {
+        "rtp": mean / SPIN_COST,
+        "hit_rate": float(PROBS[PAYOUTS > 0].sum()),
+        "mean_win": mean,
+        "variance": second - mean * mean,
+    }
+
+# -------------------------
+# Workers
+# -------------------------
+def draw_outcomes(rng: np.random.Generator, n: int) -> np.ndarray:
+    """Draws n spins as packed outcomes (same encoding and reel law as bot.draw_outcomes)."""
+    if TICKET_OUTCOMES is not None:
+        ticket_dtype = np.uint16 if len(TICKET_OUTCOMES) <= 1 << 16 else np.uint32
+        return TICKET_OUTCOMES[rng.integers(0, len(TICKET_OUTCOMES), size=n, dtype=ticket_dtype)]
+    c1, c2, c3 = np.searchsorted(REEL_CUM_PROBS, rng.random((3, n)), side="right")
+    return (c1 * bot.NUM_SYMBOLS + c2) * bot.NUM_SYMBOLS + c3
+
+def simulate_counts(seed, spins: int, batch: int) -> np.ndarray:
+    """Spins `spins` times in batches and returns how often each outcome came up."""
+    rng = np.random.default_rng(seed)
+    counts = np.zeros(len(PAYOUTS), dtype=np.int64)
+    while spins > 0:
+        n = min(batch, spins)
+        counts += np.bincount(draw_outcomes(rng, n), minlength=len(PAYOUTS))
+        spins -= n
+    return counts
+
+def simulate_ruin(seed, bankroll: int, paths: int, horizon: int, checkpoints: list) -> list:
+    """
+    Plays `paths` players from `bankroll` coins for up to `horizon` spins each.
+    Returns the fraction ruined (balance below one spin) by each checkpoint.
+    """
+    rng = np.random.default_rng(seed)
+    ruined = np.zeros(len(checkpoints), dtype=np.int64)
+    chunk = max(1, 20_000_000 // horizon)
+    done = 0
+    while done < paths:
+        n = min(chunk, paths - done)
+        net = PAYOUTS[draw_outcomes(rng, n * horizon)].reshape(n, horizon) - SPIN_COST
+        balance = bankroll + np.cumsum(net, axis=1, dtype=np.int64)
+        # a player stops at the first balance below one spin, so look at the running minimum
+        low = np.minimum.accumulate(balance, axis=1)
+        for i, t in enumerate(checkpoints):
+            ruined[i] += int(np.count_nonzero(low[:, t - 1] < SPIN_COST))
+        done += n
+    return (ruined / paths).tolist()
+
+# -------------------------
+# Driver
+# -------------------------
+def split(total: int, parts: int) -> list:
+    base, extra = divmod(total, parts)
+    return [base + (1 if i < extra else 0) for i in range(parts) if base or i < extra]
+
+def main(argv=None) -> int:
+    ap = argparse.ArgumentParser(description="Monte Carlo RTP / volatility check for the bot's paytable.")
+    ap.add_argument("--spins", type=int, default=100_000_000, help="total simulated spins")
+    ap.add_argument("--batch", type=int, default=10_000_000, help="spins drawn per NumPy batch")
+    ap.add_argument("--workers", type=int, default=os.cpu_count() or 1, help="worker processes")
+    ap.add_argument("--seed", type=int, default=None, help="base seed for reproducible runs")
+    ap.add_argument("--bankrolls", default="100,1000,10000", help="comma-separated starting balances (coins) for ruin curves")
+    ap.add_argument("--horizon", type=int, default=1_000, help="spins per simulated player for ruin curves")
+    ap.add_argument("--paths", type=int, default=5_000, help="simulated players per bankroll")
+    ap.add_argument("--tolerance", type=float, default=5.0, help="allowed deviation from the exact value, in standard errors")
+    ap.add_argument("--min-rtp", type=float, default=None, help="fail if the exact RTP is below this (e.g. 0.90)")
+    ap.add_argument("--max-rtp", type=float, default=None, help="fail if the exact RTP is above this (e.g. 0.97)")
+    args = ap.parse_args(argv)
+
+    exact = exact_stats()
+    bankrolls = [int(b) for b in args.bankrolls.split(",") if b.strip()]
+    checkpoints = sorted({t for t in (10, 100, 1_000, 10_000, 100_000) if t < args.horizon} | {args.horizon})
+    seeds = np.random.SeedSequence(args.seed).spawn(args.workers + len(bankrolls))
+
+    started = time.perf_counter()
+    with ProcessPoolExecutor(max_workers=args.workers) as pool:
+        count_jobs = [pool.submit(simulate_counts, seeds[i], n, args.batch)
+                      for i, n in enumerate(split(args.spins, args.workers))]
+        ruin_jobs = [pool.submit(simulate_ruin, seeds[args.workers + i], b, args.paths, args.horizon, checkpoints)
+                     for i, b in enumerate(bankrolls)]
+        counts = sum(job.result() for job in count_jobs)
+        ruin = [job.result() for job in ruin_jobs]
+    elapsed = time.perf_counter() - started
+
+    n = int(counts.sum())
+    total_won = float(counts @ PAYOUTS)
+    mean = total_won / n
+    variance = float(counts @ (PAYOUTS.astype(np.float64) ** 2)) / n - mean * mean
+    hits = int(counts[PAYOUTS > 0].sum())
+    sim = {"rtp": mean / SPIN_COST, "hit_rate": hits / n, "mean_win": mean, "variance": variance}
+
+    # standard errors of the estimates, from the exact distribution
+    se_mean = math.sqrt(exact["variance"] / n)
+    se = {
+        "rtp": se_mean / SPIN_COST,
+        "hit_rate": math.sqrt(exact["hit_rate"] * (1 - exact["hit_rate"]) / n),
+        "mean_win": se_mean,
+    }
+
+    print(f"🎰 Paytable check — {n:,} spins in {elapsed:.2f}s ({n / elapsed / 1e6:.1f}M spins/s, {args.workers} workers)")
+    print(f"Spin cost {SPIN_COST} coins | symbols {bot.SYMBOLS} | weights {bot.SYMBOL_WEIGHTS}")
+    print()
+    print(f"{'metric':<12}{'simulated':>16}{'exact':>16}{'dev (SE)':>12}")
+    failures = []
+    for key in ("rtp", "hit_rate", "mean_win", "variance"):
+        line = f"{key:<12}{sim[key]:>16.6f}{exact[key]:>16.6f}"
+        if key in se and se[key] > 0:
+            dev = (sim[key] - exact[key]) / se[key]
+            line += f"{dev:>12.2f}"
+            if abs(dev) > args.tolerance:
+                failures.append(f"{key} is {dev:.1f} standard errors from the exact value")
+        print(line)
+    print()
+    print(f"House edge: {(1 - exact['rtp']) * 100:.3f}% | std dev per spin: {math.sqrt(exact['variance']):.2f} coins")
+
+    print()
+    print("Bankroll ruin (fraction of players unable to afford a spin):")
+    print(f"{'bankroll':>10}" + "".join(f"{'@' + format(t, ','):>12}" for t in checkpoints))
+    for b, fractions in zip(bankrolls, ruin):
+        print(f"{b:>10}" + "".join(f"{f:>12.4f}" for f in fractions))
+
+    if args.min_rtp is not None and exact["rtp"] < args.min_rtp:
+        failures.append(f"exact RTP {exact['rtp']:.4f} is below --min-rtp {args.min_rtp}")
+    if args.max_rtp is not None and exact["rtp"] > args.max_rtp:
+        failures.append(f"exact RTP {exact['rtp']:.4f} is above --max-rtp {args.max_rtp}")
+
+    print()
+    if failures:
+        for f in failures:
+            print("FAIL:", f)
+        return 1
+    print("OK")
+    return 0
+
+if __name__ == "__main__":
+    sys.exit(main())